@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_module(name, path):
+    # stat.py shadows the standard library module, so load it by path.
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+stat = load_module('scorelib_stat', os.path.join(HERE, 'stat.py'))
+SQL_DIR = os.path.join(HERE, os.pardir, '03-sql')
+scorelib = load_module('scorelib', os.path.join(SQL_DIR, 'scorelib.py'))
+# import.py does 'import scorelib'.
+sys.modules['scorelib'] = scorelib
+importer = load_module('scorelib_import', os.path.join(SQL_DIR, 'import.py'))
+searcher = load_module('scorelib_search', os.path.join(HERE, os.pardir, '04-sql',
+                                                       'search.py'))
+
+GENRES = ['cantata', 'solo concerto', 'sonata', 'suite', 'oboe concerto',
+          'trio sonata', 'partita', 'aria']
+KEYS = ['C', 'c', 'D', 'd', 'Es', 'F', 'f', 'G', 'g', 'A', 'a', 'Bes']
+INSTRUMENTS = ['violin', 'viola', 'cello', 'oboe', 'flute', 'bassoon',
+               'harpsichord', 'piano', 'continuo', 'soprano']
+RANGES = ['g-d3', 'C2-c', 'c-e3', 'Bes1--d2', 'c1--a3', 'd1--d3']
+# Damaged values which the parsers have to tolerate.
+MALFORMED = {
+    'Composer': ['(1685--1750)', 'Anonymous (', ';;', 'Unknown (*17??)'],
+    'Composition Year': ['ca. 17??', 'unknown', '1st half of century', '-'],
+    'Genre': ['', '???'],
+    'Key': ['', '?'],
+    'Edition': ['', '(reprint'],
+}
+
+
+def _person(rnd, idx):
+    born = 1550 + idx * 7 % 400
+    dates = rnd.choice(['({}--{})'.format(born, born + 60),
+                        '(*{})'.format(born), '(+{})'.format(born + 60), ''])
+    return 'Composer{}, Name {}'.format(idx, dates).strip()
+
+
+def _year(rnd):
+    year = rnd.randint(1550, 1990)
+    return rnd.choice([str(year), str(year), 'ca. {}'.format(year),
+                       '{}th century'.format(year // 100 + 1), ''])
+
+
+def generate_record(rnd, idx, composers, voices, malformed):
+    """Returns the lines of one synthetic scorelib record."""
+    authors = [_person(rnd, rnd.randrange(composers))
+               for _ in range(rnd.choice([1, 1, 1, 2]))]
+    fields = [
+        ('Composer', '; '.join(authors)),
+        ('Title', 'Piece no. {}'.format(rnd.randrange(composers * 10))),
+        ('Genre', rnd.choice(GENRES)),
+        ('Key', rnd.choice(KEYS)),
+        ('Composition Year', _year(rnd)),
+        ('Publication Year', _year(rnd)),
+        ('Edition', 'Edition {}'.format(rnd.randrange(100))),
+        ('Editor', _person(rnd, rnd.randrange(composers))),
+    ]
+    for i in range(rnd.randint(1, voices)):
+        fields.append(('Voice {}'.format(i + 1), '{}, {}'.format(
+            rnd.choice(RANGES), rnd.choice(INSTRUMENTS))))
+    fields.append(('Partiture', rnd.choice(['yes', 'no'])))
+    fields.append(('Incipit', "treble 4/4 c4 d8 e8 |"))
+    lines = ['Print Number: {}'.format(idx)]
+    for name, value in fields:
+        if name in MALFORMED and rnd.random() < malformed:
+            value = rnd.choice(MALFORMED[name])
+        lines.append('{}: {}'.format(name, value))
+    return lines
+
+
+def generate(path, records, composers=1000, voices=4, malformed=0.01,
+             seed=0):
+    """Writes a synthetic scorelib text file with the given number of
+    records, distinct composers, maximum voice count and the probability
+    of a field being malformed."""
+    rnd = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for idx in range(records):
+            f.write('\n'.join(generate_record(rnd, idx, composers, voices,
+                                              malformed)))
+            f.write('\n\n')
+
+
+def scale_catalog(source, path, factor):
+    """Writes the source catalog repeated factor times, renumbering the
+    prints so that the print numbers stay unique."""
+    with open(source, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    number = re.compile(r'^(Print Number: *)([0-9]+)')
+    ids = [int(m.group(2)) for m in map(number.match, lines) if m]
+    step = max(ids) + 1 if ids else 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(factor):
+            for line in lines:
+                m = number.match(line)
+                if m:
+                    line = '{}{}'.format(m.group(1), int(m.group(2)) + i * step)
+                f.write(line)
+                f.write('\n')
+            f.write('\n')
+    return len(ids) * factor
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    res = fn(*args)
+    return time.perf_counter() - start, res
+
+
+def _run_century(path):
+    with open(path, encoding='utf-8') as f:
+        stat.century_parse(f)
+
+
+def _run_composer(path):
+    with open(path, encoding='utf-8') as f:
+        stat.composer_parse(f)
+
+
+def _run_load(path):
+    scorelib.load(path)
+
+
+TARGETS = {
+    'century_parse': _run_century,
+    'composer_parse': _run_composer,
+    'scorelib.load': _run_load,
+}
+
+
+def _measure(target, path):
+    elapsed, _ = timed(TARGETS[target], path)
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure_load(module_path, path):
+    module = load_module('scorelib_measured', module_path)
+    elapsed, res = timed(module.load, path)
+    return elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def in_fresh_process(fn, *args):
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def measure(target, path):
+    """Runs the target in a fresh process and returns the elapsed time and
+    the peak RSS of that process in kB."""
+    return in_fresh_process(_measure, target, path)
+
+
+def bench_scale(scales, targets, composers, voices, malformed):
+    """Throughput and peak RSS of the parsers on synthetic catalogs of
+    several sizes."""
+    print('{:>10} {:<16} {:>10} {:>14} {:>12}'.format(
+        'records', 'target', 'seconds', 'records/sec', 'peak RSS MB'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for records in scales:
+            path = os.path.join(tmp, 'scorelib-{}.txt'.format(records))
+            generate(path, records, composers, voices, malformed)
+            for target in targets:
+                elapsed, rss = measure(target, path)
+                print('{:>10} {:<16} {:>10.3f} {:>14.0f} {:>12.1f}'.format(
+                    records, target, elapsed, records / elapsed, rss / 1024))
+
+
+def bench_composers(records, distinct):
+    """Per-record cost of composer_parse as the number of distinct
+    composers grows; it should stay flat."""
+    print('{:>10} {:>10} {:>14}'.format('records', 'composers', 'us/record'))
+    for k in distinct:
+        lines = ['Composer: Composer {}, Name (1700--1750)\n'.format(i % k)
+                 for i in range(records)]
+        elapsed, res = timed(stat.composer_parse, lines)
+        assert len(res) == min(k, records)
+        print('{:>10} {:>10} {:>14.3f}'.format(records, k,
+                                               elapsed / records * 1e6))
+
+
+def bench_parser(source, factor, baseline=None):
+    """Time of scorelib.load on the bundled catalog repeated factor times,
+    optionally compared with another scorelib.py (e.g. an older one)."""
+    modules = [('scorelib', scorelib)]
+    if baseline:
+        modules.append(('baseline', load_module('scorelib_baseline',
+                                                baseline)))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scorelib.txt')
+        records = scale_catalog(source, path, factor)
+        times = {}
+        print('{:<10} {:>10} {:>10} {:>14}'.format('parser', 'records',
+                                                   'seconds', 'records/sec'))
+        for name, module in modules:
+            elapsed, res = timed(module.load, path)
+            assert len(res) == records
+            times[name] = elapsed
+            print('{:<10} {:>10} {:>10.3f} {:>14.0f}'.format(
+                name, records, elapsed, records / elapsed))
+    if baseline:
+        print('speedup: {:.2f}x'.format(times['baseline'] / times['scorelib']))
+
+
+def bench_memory(source, factor, baseline=None):
+    """Peak RSS of a process loading the bundled catalog repeated factor
+    times, optionally compared with another scorelib.py."""
+    modules = [('scorelib', scorelib.__file__)]
+    if baseline:
+        modules.append(('baseline', baseline))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scorelib.txt')
+        records = scale_catalog(source, path, factor)
+        print('{:<10} {:>10} {:>10} {:>12}'.format('parser', 'records',
+                                                   'seconds', 'peak RSS MB'))
+        for name, module_path in modules:
+            elapsed, rss = in_fresh_process(_measure_load, module_path, path)
+            print('{:<10} {:>10} {:>10.3f} {:>12.1f}'.format(
+                name, records, elapsed, rss / 1024))
+
+
+def _connect():
+    connection = sqlite3.connect(':memory:')
+    with open(os.path.join(SQL_DIR, 'scorelib.sql')) as f:
+        connection.executescript(f.read())
+    return connection
+
+
+def _key_objects(prints):
+    # What the importer does with the model objects, without the SQL.
+    ids = {}
+    for p in prints:
+        ids[p.composition()] = p.print_id
+        ids[p.edition] = p.print_id
+    for p in prints:
+        ids[p.edition.composition], ids[p.edition]
+    return ids
+
+
+def bench_hash(source, factor, baseline=None):
+    """Time of using the model objects as dict keys, alone and within
+    storeCompositions and storeEditions, optionally compared with another
+    scorelib.py."""
+    modules = [('scorelib', scorelib)]
+    if baseline:
+        modules.append(('baseline', load_module('scorelib_baseline',
+                                                baseline)))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scorelib.txt')
+        records = scale_catalog(source, path, factor)
+        print('{:<10} {:>10} {:>10} {:>10} {:>18} {:>14}'.format(
+            'model', 'records', 'keys 1st', 'keys 2nd', 'storeCompositions',
+            'storeEditions'))
+        for name, module in modules:
+            prints = module.load(path)
+            ids = {}
+            connection = _connect()
+            compositions, _ = timed(importer.storeCompositions, connection,
+                                    importer.loadCompositions(prints), ids)
+            editions, _ = timed(importer.storeEditions, connection,
+                                importer.loadEditions(prints), ids)
+            prints = module.load(path)
+            first, _ = timed(_key_objects, prints)
+            second, _ = timed(_key_objects, prints)
+            print('{:<10} {:>10} {:>10.3f} {:>10.3f} {:>18.3f} {:>14.3f}'
+                  .format(name, records, first, second, compositions,
+                          editions))
+
+
+def _format_loop(prints, f):
+    with contextlib.redirect_stdout(f):
+        for p in prints:
+            p.format()
+
+
+def bench_export(source, factor, baseline=None):
+    """Time of writing the scaled bundled catalog back to text with the
+    Print.format loop, write_prints and write_prints_json, optionally
+    compared with the format loop of another scorelib.py."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scorelib.txt')
+        out = os.path.join(tmp, 'out.txt')
+        records = scale_catalog(source, path, factor)
+        prints = scorelib.load(path)
+        runs = [('format', _format_loop, prints),
+                ('write_prints', scorelib.write_prints, prints),
+                ('write_prints_json', scorelib.write_prints_json, prints)]
+        if baseline:
+            module = load_module('scorelib_baseline', baseline)
+            runs.append(('baseline format', _format_loop, module.load(path)))
+        print('{:<18} {:>10} {:>10} {:>14}'.format('writer', 'records',
+                                                   'seconds', 'records/sec'))
+        for name, fn, prints in runs:
+            with open(out, 'w', encoding='utf-8') as f:
+                elapsed, _ = timed(fn, prints, f)
+            print('{:<18} {:>10} {:>10.3f} {:>14.0f}'.format(
+                name, records, elapsed, records / elapsed))
+
+
+def _import_db(path, prints, fn):
+    connection = sqlite3.connect(path)
+    with open(os.path.join(SQL_DIR, 'scorelib.sql')) as f:
+        connection.executescript(f.read())
+    elapsed, _ = timed(fn, connection, prints)
+    connection.close()
+    return elapsed
+
+
+def bench_import(source, factor):
+    """Time of importing the scaled bundled catalog (already parsed) into
+    an SQLite file row by row and with the bulk import."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scorelib.txt')
+        records = scale_catalog(source, path, factor)
+        prints = scorelib.load(path)
+        print('{:<10} {:>10} {:>10} {:>14}'.format('import', 'records',
+                                                   'seconds', 'records/sec'))
+        for name, fn in (('rows', importer.importRows),
+                         ('bulk', importer.importBulk)):
+            elapsed = _import_db(os.path.join(tmp, name + '.dat'), prints, fn)
+            print('{:<10} {:>10} {:>10.3f} {:>14.0f}'.format(
+                name, records, elapsed, records / elapsed))
+
+
+def bench_search(records, queries, composers, voices, malformed):
+    """Latency of search.py on a generated catalog, imported without the
+    secondary indexes, with them and ANALYZE, and with the person name full
+    text index as well."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scorelib.txt')
+        db = os.path.join(tmp, 'scorelib.dat')
+        generate(path, records, composers, voices, malformed)
+        connection = sqlite3.connect(db)
+        with open(os.path.join(SQL_DIR, 'scorelib.sql')) as f:
+            connection.executescript(f.read())
+        importer.importStreaming(connection,
+                                 scorelib.iter_prints(path, share=False))
+        print(('{:<10}' + ' {:>14}' * len(queries)).format('ms', *queries))
+        for name, fts in (('plain', None), ('indexed', False), ('fts', True)):
+            if fts is not None:
+                importer.finishImport(connection, fts)
+            times = [min(timed(searcher.search, query, db, io.StringIO())[0]
+                         for _ in range(3)) for query in queries]
+            print(('{:<10}' + ' {:>14.2f}' * len(queries)).format(
+                name, *(1000 * t for t in times)))
+        connection.close()
+
+
+def bench_snapshot(source, factor):
+    """Time of loading the scaled bundled catalog from text and from a
+    binary snapshot (opening it, then materializing every print)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'scorelib.txt')
+        snapshot = os.path.join(tmp, 'scorelib.snapshot')
+        records = scale_catalog(source, path, factor)
+        text, prints = timed(scorelib.load, path)
+        save, _ = timed(scorelib.save_snapshot, prints, snapshot, path)
+        opened, prints = timed(scorelib.load, path, True, snapshot)
+        assert isinstance(prints, scorelib.Snapshot)
+        full, _ = timed(list, prints)
+        prints.close()
+        print('{:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            'records', 'text', 'save', 'open', 'all'))
+        print('{:>10} {:>10.3f} {:>10.3f} {:>10.4f} {:>10.3f}'.format(
+            records, text, save, opened, full))
+
+
+def _add_catalog_arguments(parser):
+    parser.add_argument('-k', '--composers', type=int, default=1000,
+                        help='number of distinct composers')
+    parser.add_argument('-v', '--voices', type=int, default=4,
+                        help='maximum number of voices of a record')
+    parser.add_argument('-m', '--malformed', type=float, default=0.01,
+                        help='probability of a field being malformed')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the '
+                                                 'scorelib statistics.')
+    sub = parser.add_subparsers(dest='bench')
+    scale = sub.add_parser('scale', help=bench_scale.__doc__)
+    scale.add_argument('-n', '--records', type=int, nargs='+',
+                       default=[10000, 100000, 1000000])
+    scale.add_argument('-t', '--targets', nargs='+', choices=list(TARGETS),
+                       default=list(TARGETS))
+    _add_catalog_arguments(scale)
+    gen = sub.add_parser('generate', help=generate.__doc__)
+    gen.add_argument('output')
+    gen.add_argument('-n', '--records', type=int, default=100000)
+    gen.add_argument('-s', '--seed', type=int, default=0)
+    _add_catalog_arguments(gen)
+    for name, fn in (('parser', bench_parser), ('memory', bench_memory),
+                     ('hash', bench_hash), ('export', bench_export)):
+        cmd = sub.add_parser(name, help=fn.__doc__)
+        cmd.add_argument('-f', '--factor', type=int, default=100)
+        cmd.add_argument('-s', '--source',
+                         default=os.path.join(HERE, 'scorelib.txt'))
+        cmd.add_argument('-b', '--baseline', metavar='SCORELIB_PY',
+                         help='another scorelib.py to compare with')
+    for name, fn in (('snapshot', bench_snapshot), ('import', bench_import)):
+        cmd = sub.add_parser(name, help=fn.__doc__)
+        cmd.add_argument('-f', '--factor', type=int, default=100)
+        cmd.add_argument('-s', '--source',
+                         default=os.path.join(HERE, 'scorelib.txt'))
+    search = sub.add_parser('search', help=bench_search.__doc__)
+    search.add_argument('-n', '--records', type=int, default=20000)
+    search.add_argument('-q', '--queries', nargs='+',
+                        default=['Composer7,', 'Composer7', 'nobody'])
+    _add_catalog_arguments(search)
+    composers = sub.add_parser('composers', help=bench_composers.__doc__)
+    composers.add_argument('-n', '--records', type=int, default=200000)
+    composers.add_argument('-k', '--distinct', type=int, nargs='+',
+                           default=[10, 1000, 10000, 100000])
+    args = parser.parse_args()
+    if args.bench == 'scale':
+        bench_scale(args.records, args.targets, args.composers, args.voices,
+                    args.malformed)
+    elif args.bench == 'generate':
+        generate(args.output, args.records, args.composers, args.voices,
+                 args.malformed, args.seed)
+    elif args.bench == 'parser':
+        bench_parser(args.source, args.factor, args.baseline)
+    elif args.bench == 'memory':
+        bench_memory(args.source, args.factor, args.baseline)
+    elif args.bench == 'hash':
+        bench_hash(args.source, args.factor, args.baseline)
+    elif args.bench == 'export':
+        bench_export(args.source, args.factor, args.baseline)
+    elif args.bench == 'snapshot':
+        bench_snapshot(args.source, args.factor)
+    elif args.bench == 'import':
+        bench_import(args.source, args.factor)
+    elif args.bench == 'search':
+        bench_search(args.records, args.queries, args.composers, args.voices,
+                     args.malformed)
+    elif args.bench == 'composers':
+        bench_composers(args.records, args.distinct)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,28 @@ try:
 except SystemError:
     from stat import *
 
+import argparse
+import io
+import os
+import tempfile
 import unittest
 
+SCORELIB = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, 'scorelib.txt')
+
+SAMPLE = """Print Number: 0
+Composer: Bach, Johann Sebastian; Telemann, Georg Philipp (1681--1767)
+Composition Year: 1728
+
+Print Number: 1
+Composer: Bach, Johann Sebastian
+Composition Year: 17th century
+
+Print Number: 2
+Composer:
+Composition Year:
+"""
+
 class TestStat(unittest.TestCase):
 
     def test_year_to_century(self):
@@ -13,6 +33,63 @@ class TestStat(unittest.TestCase):
         self.assertEqual(year_to_century(1099), 10)
         self.assertEqual(year_to_century(1100), 11)
 
+    def test_parse_single_pass(self):
+        res = parse(io.StringIO(SAMPLE), ['composer', 'century'])
+        self.assertEqual(res['composer'],
+                         composer_parse(io.StringIO(SAMPLE)))
+        self.assertEqual(res['century'], century_parse(io.StringIO(SAMPLE)))
+        self.assertEqual(res['composer']['Bach, Johann Sebastian'], 2)
+        self.assertEqual(res['composer']['Telemann, Georg Philipp'], 1)
+        self.assertEqual(res['century'], {18: 1, 17: 1})
+
+    def test_parallel_parse(self):
+        names = ['composer', 'century']
+        with open(SCORELIB, encoding='utf-8') as f:
+            expected = parse(f, names)
+        self.assertEqual(parallel_parse(SCORELIB, names, 3), expected)
+
+    def test_mmap_parse(self):
+        names = ['composer', 'century']
+        with open(SCORELIB, encoding='utf-8') as f:
+            expected = parse(f, names)
+        self.assertEqual(mmap_parse(SCORELIB, names), expected)
+        self.assertEqual(parallel_parse(SCORELIB, names, 2, True), expected)
+
+    def test_cached_parse(self):
+        names = ['composer', 'century']
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'scorelib.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(SAMPLE[:60])
+            self.assertEqual(cached_parse(path, names),
+                             parse(io.StringIO(SAMPLE[:60]), names))
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(SAMPLE[60:])
+            self.assertEqual(cached_parse(path, names),
+                             parse(io.StringIO(SAMPLE), names))
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(SAMPLE.replace('Bach', 'Haendel'))
+            self.assertEqual(cached_parse(path, ['composer'])['composer'],
+                             composer_parse(io.StringIO(
+                                 SAMPLE.replace('Bach', 'Haendel'))))
+
+    def test_report_top(self):
+        res = composer_parse(io.StringIO(SAMPLE))
+        out = io.StringIO()
+        report(res, composer_format, 1, out)
+        self.assertEqual(out.getvalue(), 'Bach, Johann Sebastian: 2\n')
+        out = io.StringIO()
+        report_json('composer', res, None, out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            '{"composer": "Bach, Johann Sebastian", "count": 2}',
+            '{"composer": "Telemann, Georg Philipp", "count": 1}'])
+
+    def test_positive_int(self):
+        self.assertEqual(positive_int('5'), 5)
+        for value in ('0', '-5'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                positive_int(value)
+
     def test_isupper(self):
         self.assertTrue('FOO'.isupper())
         self.assertFalse('Foo'.isupper())
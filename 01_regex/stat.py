@@ -1,8 +1,19 @@
 #!/usr/bin/env python3
 
+import argparse
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
 import sys
 import re
-from collections import Counter
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+# Catalogs repeat a few hundred distinct year and composer strings, so the
+# value parsers are memoized in bounded caches.
+CACHE_SIZE = 4096
 
 
 def year_to_century(year):
@@ -10,6 +21,7 @@ def year_to_century(year):
     return c if year % 100 == 0 else c + 1
 
 
+@lru_cache(maxsize=CACHE_SIZE)
 def parse_century(data):
     data = data.strip()
     if not data:
@@ -23,16 +35,14 @@ def parse_century(data):
     return None
 
 
+def century_add(centuries, value):
+    c = parse_century(value)
+    if c:
+        centuries[c] += 1
+
+
 def century_parse(f):
-    r = re.compile(r'^Composition Year: +(.+)')
-    centuries = Counter()
-    for line in f:
-        match = r.match(line)
-        if match:
-            c = parse_century(match.group(1))
-            if c:
-                centuries[c] += 1
-    return centuries
+    return parse(f, ['century'])['century']
 
 
 def num_suffix(n):
@@ -47,43 +57,366 @@ def num_suffix(n):
 
 
 def century(f):
-    res = century_parse(f)
-    for century in sorted(res.keys()):
-        print('{}{} century: {}'.format(century,
-                                        num_suffix(century),
-                                        res[century]))
+    century_print(century_parse(f))
+
+
+def century_format(century, count):
+    return '{}{} century: {}'.format(century, num_suffix(century), count)
+
+
+def century_print(res, top=None):
+    report(res, century_format, top)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def composer_names(value):
+    c = re.sub(r'\(.*?\)', '', value)
+    return frozenset(i.strip() for i in c.split(';') if i.strip())
+
+
+def composer_add(composers, value):
+    # update() counts in place; Counter's += would also rescan all the keys
+    # to drop non-positive counts, which makes the scan quadratic.
+    composers.update(composer_names(value))
 
 
 def composer_parse(f):
-    r = re.compile(r'Composer: (.*)')
-    composers = Counter()
-    for line in f:
-        match = r.match(line)
-        if match:
-            c = re.sub(r'\(.*?\)', '', match.group(1))
-            composers += {i.strip(): 1 for i in c.split(';') if i.strip()}
-    return composers
+    return parse(f, ['composer'])['composer']
 
 
 def composer(f):
-    res = composer_parse(f)
-    for composer in sorted(res.keys()):
-        print('{}: {}'.format(composer, res[composer]))
+    composer_print(composer_parse(f))
+
+
+def composer_format(composer, count):
+    return '{}: {}'.format(composer, count)
+
+
+def composer_print(res, top=None):
+    report(res, composer_format, top)
+
+
+def _items(res, top):
+    # most_common selects with a heap, so only the top entries get sorted.
+    if top is None:
+        return sorted(res.items())
+    return res.most_common(top)
+
+
+def report(res, fmt, top=None, out=None):
+    """Prints the counts ordered by key or, given top, the top most common
+    ones ordered by count."""
+    out = out if out is not None else sys.stdout
+    for key, count in _items(res, top):
+        out.write(fmt(key, count))
+        out.write('\n')
+
+
+def report_json(name, res, top=None, out=None):
+    """Like report, but streams one JSON object per line."""
+    out = out if out is not None else sys.stdout
+    for key, count in _items(res, top):
+        out.write(json.dumps({name: key, 'count': count}, ensure_ascii=False))
+        out.write('\n')
+
+
+# Every statistic is an aggregator: a regex matched at the start of a line
+# capturing the relevant value in its only group, a function adding the
+# value to a Counter and a function formatting one line of the report.
+Aggregator = namedtuple('Aggregator', ['pattern', 'add', 'format'])
+
+AGGREGATORS = {
+    'composer': Aggregator(r'Composer: (.*)', composer_add, composer_format),
+    'century': Aggregator(r'Composition Year: +(.+)', century_add,
+                          century_format),
+}
+
+
+MEMOIZED = {'parse_century': parse_century,
+            'composer_names': composer_names}
+
+# Cache statistics reported by the worker processes of parallel_parse.
+_worker_cache_stats = {name: Counter() for name in MEMOIZED}
+
+
+def _local_cache_stats():
+    stats = {}
+    for name, fn in MEMOIZED.items():
+        info = fn.cache_info()
+        stats[name] = Counter(hits=info.hits, misses=info.misses)
+    return stats
+
+
+def cache_stats():
+    """Hit and miss counts of the memoized parsers, including the ones of
+    the worker processes."""
+    stats = _local_cache_stats()
+    for name in stats:
+        stats[name].update(_worker_cache_stats[name])
+    return stats
+
+
+def print_cache_stats(out=None):
+    out = out if out is not None else sys.stderr
+    for name, stats in cache_stats().items():
+        total = stats['hits'] + stats['misses']
+        out.write('{} cache: {} hits, {} misses ({:.1f}% hit rate)\n'.format(
+            name, stats['hits'], stats['misses'],
+            100 * stats['hits'] / total if total else 0))
+
+
+def parse(f, names):
+    """Computes all the named statistics in a single pass over the lines."""
+    names = list(dict.fromkeys(names))
+    results = {name: Counter() for name in names}
+    handlers = [(re.compile(AGGREGATORS[name].pattern).match,
+                 AGGREGATORS[name].add, results[name]) for name in names]
+    for line in f:
+        for match_fn, add_fn, counter in handlers:
+            match = match_fn(line)
+            if match:
+                add_fn(counter, match.group(1))
+    return results
+
+
+def _bytes_regex(names):
+    # A single alternation of all the aggregators; since each alternative
+    # has exactly one group, lastindex tells which of them matched.
+    return re.compile(b'^(?:' + b'|'.join(b'(?:' + AGGREGATORS[name].pattern
+                                          .encode('utf-8') + b')'
+                                          for name in names) + b')',
+                      re.MULTILINE)
+
+
+def mmap_parse(filename, names, start=0, end=None):
+    """Like parse, but memory-maps the file and runs one bytes regex over
+    the whole buffer, decoding only the matched values."""
+    names = list(dict.fromkeys(names))
+    results = {name: Counter() for name in names}
+    if os.path.getsize(filename) == 0:
+        return results
+    handlers = [(AGGREGATORS[name].add, results[name]) for name in names]
+    regex = _bytes_regex(names)
+    with open(filename, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if end is None:
+            end = len(buf)
+        for match in regex.finditer(buf, start, end):
+            idx = match.lastindex
+            add_fn, counter = handlers[idx - 1]
+            add_fn(counter, match.group(idx).decode('utf-8'))
+    return results
+
+
+def chunk_ranges(filename, count):
+    """Splits the file into at most count byte ranges, each one starting
+    right after a blank line (i.e. at a record boundary)."""
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, 'rb') as f:
+        for i in range(1, count):
+            pos = size * i // count
+            if pos <= bounds[-1]:
+                continue
+            f.seek(pos)
+            f.readline()
+            while True:
+                line = f.readline()
+                if not line or not line.strip():
+                    break
+            pos = f.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def _read_range(f, length):
+    for line in f:
+        if length <= 0:
+            return
+        length -= len(line)
+        yield line.decode('utf-8')
+
+
+def _parse_chunk(args):
+    filename, start, end, names, use_mmap = args
+    before = _local_cache_stats()
+    if use_mmap:
+        results = mmap_parse(filename, names, start, end)
+    else:
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            results = parse(_read_range(f, end - start), names)
+    after = _local_cache_stats()
+    return results, {name: after[name] - before[name] for name in after}
+
+
+def parallel_parse(filename, names, jobs, use_mmap=False):
+    """Like parse, but the file is split into record aligned chunks which
+    are parsed by a pool of jobs processes."""
+    names = list(dict.fromkeys(names))
+    results = {name: Counter() for name in names}
+    tasks = [(filename, start, end, names, use_mmap)
+             for start, end in chunk_ranges(filename, jobs * 4)]
+    with multiprocessing.Pool(jobs) as pool:
+        for chunk, stats in pool.imap_unordered(_parse_chunk, tasks):
+            for name in names:
+                results[name].update(chunk[name])
+            for name in stats:
+                _worker_cache_stats[name].update(stats[name])
+    return results
+
+
+CACHE_SUFFIX = '.statcache'
+BLOCK_SIZE = 1 << 20
+
+
+def _hash_range(f, digest, length):
+    while length > 0:
+        block = f.read(min(BLOCK_SIZE, length))
+        if not block:
+            break
+        digest.update(block)
+        length -= len(block)
+    return digest
+
+
+def _last_line_end(f, size):
+    # Offset just past the last newline; a trailing unterminated line may
+    # still grow when the file is appended to, so it is never cached.
+    pos = size
+    while pos > 0:
+        start = max(0, pos - BLOCK_SIZE)
+        f.seek(start)
+        idx = f.read(pos - start).rfind(b'\n')
+        if idx >= 0:
+            return start + idx + 1
+        pos = start
+    return 0
+
+
+def _load_cache(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            cache = json.load(f)
+        return (cache['offset'], cache['sha1'],
+                {name: Counter(dict((k, v) for k, v in counts))
+                 for name, counts in cache['counters'].items()})
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _save_cache(path, offset, digest, counters):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'offset': offset,
+                   'sha1': digest,
+                   'counters': {name: list(counter.items())
+                                for name, counter in counters.items()}},
+                  f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def cached_parse(filename, names):
+    """Like parse, but keeps the counters of the already processed prefix
+    of the file in a cache next to it, so that after the file is appended
+    to only the new lines are scanned. The whole file is scanned again if
+    the cached prefix no longer matches its checksum."""
+    names = list(dict.fromkeys(names))
+    path = filename + CACHE_SUFFIX
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        end = _last_line_end(f, size)
+        f.seek(0)
+        cache = _load_cache(path)
+        if cache is not None:
+            offset, checksum, counters = cache
+            if offset <= end and all(name in counters for name in names):
+                digest = _hash_range(f, hashlib.sha1(), offset)
+                if digest.hexdigest() != checksum:
+                    cache = None
+            else:
+                cache = None
+        if cache is None:
+            f.seek(0)
+            offset, counters = 0, {}
+            digest = hashlib.sha1()
+        _hash_range(f, digest, end - offset)
+    stored = list(dict.fromkeys(list(counters) + names))
+    for name, counter in mmap_parse(filename, stored, offset, end).items():
+        counters.setdefault(name, Counter()).update(counter)
+    _save_cache(path, end, digest.hexdigest(), counters)
+    results = {name: Counter(counters[name]) for name in names}
+    if end < size:
+        for name, counter in mmap_parse(filename, names, end).items():
+            results[name].update(counter)
+    return results
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            '{} is not a positive number'.format(value))
+    return number
 
 
 def main():
-    commands = {'composer': composer, 'century': century, }
-    if len(sys.argv) != 3:
-        sys.stderr.write('Usage: ./stat.py scoreboard command.\n')
+    parser = argparse.ArgumentParser(description='Prints statistics about '
+                                                 'a scorelib text file.')
+    parser.add_argument('scoreboard')
+    parser.add_argument('command', help='one of {} or a comma separated list '
+                                        'of them'.format(', '.join(AGGREGATORS)))
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of processes scanning the file')
+    parser.add_argument('-m', '--mmap', action='store_true',
+                        help='memory-map the file and match bytes regexes '
+                             'over the whole buffer')
+    parser.add_argument('-c', '--cache', action='store_true',
+                        help='keep the results in a cache next to the file '
+                             'and only scan lines appended since the last '
+                             'run')
+    parser.add_argument('-t', '--top', type=positive_int, metavar='N',
+                        help='print only the N most common entries')
+    parser.add_argument('--json', action='store_true',
+                        help='print the entries as JSON lines')
+    parser.add_argument('-s', '--stats', action='store_true',
+                        help='print hit/miss counts of the parser caches to '
+                             'stderr')
+    args = parser.parse_args()
+    if args.cache and (args.jobs > 1 or args.mmap):
+        parser.error('argument -c/--cache: not allowed with argument '
+                     '-j/--jobs or -m/--mmap')
+    commandNames = [i.strip() for i in args.command.split(',') if i.strip()]
+    for commandName in commandNames:
+        if commandName not in AGGREGATORS:
+            sys.stderr.write('Given command "{}". '.format(commandName)
+                             + 'Command has to be one of: '
+                             + ', '.join(['"{}"'.format(i)
+                                          for i in AGGREGATORS]))
+            sys.exit(1)
+    if not commandNames:
+        sys.stderr.write('No command given.\n')
         sys.exit(1)
-    commandName = sys.argv[2]
-    if commandName not in commands:
-        sys.stderr.write('Given command "{}". '.format(commandName)
-                         + 'Command has to be one of: '
-                         + ', '.join(['"{}"'.format(i) for i in commands]))
-        sys.exit(1)
-    command = commands[commandName]
-    command(open(sys.argv[1]))
+    if args.cache:
+        results = cached_parse(args.scoreboard, commandNames)
+    elif args.jobs > 1:
+        results = parallel_parse(args.scoreboard, commandNames, args.jobs,
+                                 args.mmap)
+    elif args.mmap:
+        results = mmap_parse(args.scoreboard, commandNames)
+    else:
+        with open(args.scoreboard, encoding='utf-8') as f:
+            results = parse(f, commandNames)
+    for commandName in commandNames:
+        if args.json:
+            report_json(commandName, results[commandName], args.top)
+        else:
+            report(results[commandName], AGGREGATORS[commandName].format,
+                   args.top)
+    if args.stats:
+        print_cache_stats()
 
 
 if __name__ == '__main__':
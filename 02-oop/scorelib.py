@@ -1,16 +1,33 @@
 #!/usr/bin/env python3
 
+import array
+import bisect
+import collections.abc
+import hashlib
+import io
+import json
+import mmap
+import multiprocessing
+import os
 import re
+import struct
+import sys
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
 
 def _str(val):
   return str(val) if val is not None else ''
 
 
-class Print:
-  def __init__(self, edition, print_id, partiture):
-    self.edition = edition
-    self.print_id = print_id
-    self.partiture = partiture if partiture else False
+class _PrintBase:
+  # The methods shared by Print and LazyPrint, which hold their fields
+  # differently; it has no slots so that LazyPrint carries none it does not
+  # use.
+  __slots__ = ()
 
   def composition(self):
     return self.edition.composition
@@ -19,86 +36,148 @@ class Print:
     print(self.__str__())
 
   def __str__(self):
-    lines = []
-    for idx, v in enumerate(self.composition().voices):
-      lines.append('Voice {}: {}\n'.format(idx + 1, str(v)))
-    voices = ''.join(lines)
-    return """Print Number: {}
-Composer: {}
-Title: {}
-Genre: {}
-Key: {}
-Composition Year: {}
-Edition: {}
-Editor: {}
-{}Partiture: {}
-Incipit: {}
-""".format(self.print_id,
-           '; '.join(map(str, self.composition().authors)),
-           _str(self.composition().name),
-           _str(self.composition().genre),
-           _str(self.composition().key),
-           _str(self.composition().year),
-           _str(self.edition.name),
-           '; '.join(map(str, self.edition.authors)),
-           voices,
-           'yes' if self.partiture else 'no',
-           _str(self.composition().incipit))
+    parts = []
+    self._write(parts)
+    return ''.join(parts)
+
+  def _write(self, out):
+    # Appends the pieces of the text format of the print to the list out.
+    edition = self.edition
+    c = edition.composition
+    out += ('Print Number: ', str(self.print_id),
+            '\nComposer: ', '; '.join(map(str, c.authors)),
+            '\nTitle: ', _str(c.name),
+            '\nGenre: ', _str(c.genre),
+            '\nKey: ', _str(c.key),
+            '\nComposition Year: ', _str(c.year),
+            '\nEdition: ', _str(edition.name),
+            '\nEditor: ', '; '.join(map(str, edition.authors)), '\n')
+    for idx, v in enumerate(c.voices, 1):
+      out += ('Voice ', str(idx), ': ', str(v), '\n')
+    out += ('Partiture: ', 'yes' if self.partiture else 'no',
+            '\nIncipit: ', _str(c.incipit), '\n')
+
+  def to_json(self):
+    edition = self.edition
+    c = edition.composition
+    return {'Print Number': self.print_id,
+            'Composer': [p.to_json() for p in c.authors],
+            'Title': c.name,
+            'Genre': c.genre,
+            'Key': c.key,
+            'Composition Year': c.year,
+            'Edition': edition.name,
+            'Editor': [p.to_json() for p in edition.authors],
+            'Voices': [v.to_json() for v in c.voices],
+            'Partiture': bool(self.partiture),
+            'Incipit': c.incipit}
 
   def __key(self):
     return (self.edition, self.print_id, self.partiture)
 
   def __eq__(self, other):
-    return type(other) == type(self) and other.__key() == self.__key()
+    return isinstance(other, _PrintBase) and other.__key() == self.__key()
 
   def __hash__(self):
     return hash(self.__key())
 
 
-class Edition:
-  def __init__(self, composition, authors, name):
-    self.composition = composition
-    self.authors = authors if authors else []
-    self.name = name if name else ''
+class Print(_PrintBase):
+  __slots__ = ('edition', 'print_id', 'partiture')
 
-  def pub_key(self):
-    return self.__key()
+  def __init__(self, edition, print_id, partiture):
+    self.edition = edition
+    self.print_id = print_id
+    self.partiture = partiture if partiture else False
+
+
+_set = object.__setattr__
 
-  def __key(self):
-    return (self.composition, frozenset(self.authors), self.name)
+
+class _Immutable:
+  # Compositions and editions are used as dict keys over and over, so they
+  # cannot be changed after construction and their key and hash are
+  # computed only once. The eager and lazy classes of the same _kind
+  # compare equal when their fields do.
+  __slots__ = ('_key', '_hash')
+
+  def __setattr__(self, name, value):
+    raise AttributeError('{} is immutable'.format(type(self).__name__))
+
+  def __delattr__(self, name):
+    raise AttributeError('{} is immutable'.format(type(self).__name__))
+
+  def pub_key(self):
+    try:
+      return self._key
+    except AttributeError:
+      _set(self, '_key', self._make_key())
+      return self._key
 
   def __eq__(self, other):
-    return type(other) == type(self) and other.__key() == self.__key()
+    if self is other:
+      return True
+    return (isinstance(other, _Immutable) and other._kind == self._kind
+            and hash(other) == hash(self)
+            and other.pub_key() == self.pub_key())
 
   def __hash__(self):
-    return hash(self.__key())
+    try:
+      return self._hash
+    except AttributeError:
+      _set(self, '_hash', hash(self.pub_key()))
+      return self._hash
 
 
-class Composition:
-  def __init__(self, name, incipit, key, genre, year, voices, authors):
-    self.name = name
-    self.incipit = incipit
-    self.key = key
-    self.genre = genre
-    self.year = year
-    self.voices = voices
-    self.authors = authors
+class _EditionBase(_Immutable):
+  __slots__ = ()
+  _kind = 'edition'
 
-  def pub_key(self):
-    return self.__key()
+  def __reduce__(self):
+    return (Edition, (self.composition, self.authors, self.name))
 
-  def __key(self):
+  def _make_key(self):
+    return (self.composition, frozenset(self.authors), self.name)
+
+
+class Edition(_EditionBase):
+  __slots__ = ('composition', 'authors', 'name')
+
+  def __init__(self, composition, authors, name):
+    _set(self, 'composition', composition)
+    _set(self, 'authors', tuple(authors) if authors else ())
+    _set(self, 'name', name if name else '')
+
+
+class _CompositionBase(_Immutable):
+  __slots__ = ()
+  _kind = 'composition'
+
+  def __reduce__(self):
+    return (Composition, (self.name, self.incipit, self.key, self.genre,
+                          self.year, self.voices, self.authors))
+
+  def _make_key(self):
     return (self.name, self.incipit, self.key, self.genre, self.year, frozenset(self.voices), frozenset(self.authors))
 
-  def __eq__(self, other):
-    return type(other) == type(self) and other.__key() == self.__key()
 
-  def __hash__(self):
+class Composition(_CompositionBase):
+  __slots__ = ('name', 'incipit', 'key', 'genre', 'year', 'voices',
+               'authors')
 
-    return hash(self.__key())
+  def __init__(self, name, incipit, key, genre, year, voices, authors):
+    _set(self, 'name', name)
+    _set(self, 'incipit', incipit)
+    _set(self, 'key', key)
+    _set(self, 'genre', genre)
+    _set(self, 'year', year)
+    _set(self, 'voices', tuple(voices) if voices else ())
+    _set(self, 'authors', tuple(authors) if authors else ())
 
 
 class Voice:
+  __slots__ = ('name', 'range')
+
   def __init__(self, name, range):
     self.name = name
     self.range = range
@@ -106,6 +185,9 @@ class Voice:
   def __str__(self):
     return ', '.join([i for i in [self.range, self.name] if i])
 
+  def to_json(self):
+    return {'Name': self.name, 'Range': self.range}
+
   def __key(self):
     return (self.name, self.range)
 
@@ -117,6 +199,8 @@ class Voice:
 
 
 class Person:
+  __slots__ = ('name', 'born', 'died')
+
   def __init__(self, name, born, died):
     self.name = name
     self.born = born
@@ -127,6 +211,9 @@ class Person:
       return '{} ({}--{})'.format(self.name, _str(self.born), _str(self.died))
     return self.name
 
+  def to_json(self):
+    return {'Name': self.name, 'Born': self.born, 'Died': self.died}
+
   def __key(self):
     return (self.name)
 
@@ -137,26 +224,197 @@ class Person:
     return hash(self.__key())
 
 
-def load(filename):
-  prints = []
+def _iter_records(f, lazy, share=True):
+  shared = {} if share else None
+  process = _process_lazy if lazy else _process_lines
+  lines = []
+  for line in f:
+    line = line.strip()
+    if line:
+      lines.append(line)
+    else:
+      val = process(lines, shared)
+      if val is not None:
+        yield val
+      lines = []
+  val = process(lines, shared)
+  if val is not None:
+    yield val
+
+
+def iter_prints(filename, lazy=False, share=True):
+  # Yields the prints in file order as soon as each record is complete.
+  # Lazy prints parse their fields on first access. Without share, equal
+  # people and voices are not interned, so memory does not grow with the
+  # number of distinct ones seen so far.
   with open(filename, encoding='utf-8') as f:
-    lines = []
-    for line in f:
-      line = line.strip()
-      if line:
-        lines.append(line)
-      else:
-        val = _process_lines(lines)
-        if val is not None:
-          prints.append(val)
-        lines = []
-    val = _process_lines(lines)
-    if val is not None:
-      prints.append(val)
-  prints.sort(key=lambda x: x.print_id)
+    yield from _iter_records(f, lazy, share)
+
+
+def iter_chunks(filename, count):
+  # Yields at most count (start, end) byte ranges that split the file, each
+  # one starting right after a blank line, i.e. at a record boundary; they
+  # can be parsed independently with load_chunk.
+  size = os.path.getsize(filename)
+  bounds = [0]
+  with open(filename, 'rb') as f:
+    for i in range(1, count):
+      pos = size * i // count
+      if pos <= bounds[-1]:
+        continue
+      f.seek(pos)
+      f.readline()
+      while True:
+        line = f.readline()
+        if not line or not line.strip():
+          break
+      pos = f.tell()
+      if bounds[-1] < pos < size:
+        bounds.append(pos)
+  bounds.append(size)
+  yield from zip(bounds, bounds[1:])
+
+
+def load_chunk(filename, start, end, lazy=False):
+  # Returns the prints of the records in one range from iter_chunks, in
+  # file order.
+  with open(filename, 'rb') as f:
+    f.seek(start)
+    data = f.read(end - start).decode('utf-8')
+  return list(_iter_records(io.StringIO(data, newline=None), lazy))
+
+
+def _load_chunk(args):
+  return load_chunk(*args)
+
+
+def _load_parallel(filename, workers, lazy):
+  tasks = [(filename, start, end, lazy)
+           for start, end in iter_chunks(filename, workers * 4)]
+  prints = []
+  with multiprocessing.Pool(workers) as pool:
+    for chunk in pool.imap(_load_chunk, tasks):
+      prints.extend(chunk)
   return prints
 
 
+def load(filename, sort=True, snapshot=None, lazy=False, workers=1):
+  # Returns a list of prints. With a snapshot path, a Snapshot, a read-only
+  # sequence to be closed when done with, is returned instead: the snapshot
+  # is used if it is up to date with the file; otherwise the file is parsed,
+  # the snapshot rewritten and then opened. With more than one worker,
+  # record aligned chunks of the file are parsed in a process pool.
+  if snapshot is not None:
+    try:
+      prints = load_snapshot(snapshot, filename)
+    except (OSError, ValueError, struct.error):
+      prints = None
+    if prints is not None:
+      if prints.sorted == sort:
+        return prints
+      prints.close()
+    # Taken before the file is read, so that an edit made while it is
+    # parsed leaves the snapshot out of date.
+    stamp = _source_stamp(filename)
+  if workers > 1:
+    prints = _load_parallel(filename, workers, lazy)
+  else:
+    prints = list(iter_prints(filename, lazy))
+  if sort:
+    prints.sort(key=lambda x: x.print_id)
+  if snapshot is not None:
+    save_snapshot(prints, snapshot, filename, sort, stamp)
+    return Snapshot(snapshot)
+  return prints
+
+
+# One or more blank lines separating two records.
+_RE_SEPARATOR = re.compile(rb'\n(?:[ \t\r\f\v]*\n)+')
+
+Changes = collections.namedtuple('Changes', ['added', 'removed', 'modified'])
+
+
+class IncrementalLoader:
+  # Loads a catalog that is being edited over and over. The prints of every
+  # record are remembered by the SHA-1 of its bytes, and on the next load
+  # only the records whose bytes are new get parsed; the others reuse their
+  # prints.
+  def __init__(self, filename):
+    self.filename = filename
+    self.reparsed = 0
+    self._parsed = {}
+    self._ids = {}
+
+  def _records(self, data):
+    start = 0
+    for match in _RE_SEPARATOR.finditer(data):
+      yield start, match.start() + 1
+      start = match.end()
+    yield start, len(data)
+
+  def load(self, sort=True):
+    # Returns the prints and the Changes (sorted lists of added, removed
+    # and modified print ids) since the previous load.
+    with open(self.filename, 'rb') as f:
+      data = f.read()
+    view = memoryview(data)
+    parsed, ids, prints = {}, {}, []
+    self.reparsed = 0
+    for start, end in self._records(data):
+      if not data[start:end].strip():
+        continue
+      digest = hashlib.sha1(view[start:end]).digest()
+      records = parsed.get(digest)
+      if records is None:
+        records = self._parsed.get(digest)
+        if records is None:
+          text = str(view[start:end], 'utf-8')
+          records = list(_iter_records(io.StringIO(text, newline=None),
+                                       False))
+          self.reparsed += 1
+        parsed[digest] = records
+      for p in records:
+        prints.append(p)
+        ids[p.print_id] = digest
+    old = self._ids
+    changes = Changes(sorted(i for i in ids if i not in old),
+                      sorted(i for i in old if i not in ids),
+                      sorted(i for i in ids if i in old and old[i] != ids[i]))
+    self._parsed, self._ids = parsed, ids
+    if sort:
+      prints.sort(key=lambda x: x.print_id)
+    return prints, changes
+
+
+_WRITE_BATCH = 4096
+
+
+def write_prints(prints, f):
+  # Writes the prints in the text format, the same as calling format() on
+  # each of them, buffering the pieces into large writes.
+  parts = []
+  for p in prints:
+    p._write(parts)
+    parts.append('\n')
+    if len(parts) >= _WRITE_BATCH:
+      f.write(''.join(parts))
+      parts.clear()
+  f.write(''.join(parts))
+
+
+def write_prints_json(prints, f):
+  # Writes one JSON object per print and line.
+  encode = json.JSONEncoder(ensure_ascii=False).encode
+  parts = []
+  for p in prints:
+    parts.append(encode(p.to_json()))
+    parts.append('\n')
+    if len(parts) >= _WRITE_BATCH:
+      f.write(''.join(parts))
+      parts.clear()
+  f.write(''.join(parts))
+
+
 def _parse_bool(s):
   if s == 'yes':
     return True
@@ -166,89 +424,141 @@ def _parse_bool(s):
     return False
 
 
+_RE_YEARS = re.compile(r'\(([0-9]{4})?--?([0-9]{4})?\)')
+_RE_BORN = re.compile(r'\(\*([0-9]{4})\)')
+_RE_DIED = re.compile(r'\(\+([0-9]{4})\)')
+_RE_YEAR = re.compile(r'[0-9]{4}')
+
+
 def _parse_people(raw):
   if raw is None:
     return []
   data = [i.strip() for i in raw.split(';') if i.strip()]
   res = []
-  re_year = re.compile(r'\(([0-9]{4})?--?([0-9]{4})?\)')
-  re_born = re.compile(r'\(\*([0-9]{4})\)')
-  re_died = re.compile(r'\(\+([0-9]{4})\)')
   for auth in data:
     year = [None, None]
-    match = re_year.search(auth)
+    match = _RE_YEARS.search(auth)
     if match:
       year = [int(i) if i else i for i in (match.group(1), match.group(2))]
-    match = re_born.search(auth)
+    match = _RE_BORN.search(auth)
     if match:
       year[0] = int(match.group(1))
-    match = re_died.search(auth)
+    match = _RE_DIED.search(auth)
     if match:
       year[1] = int(match.group(1))
-    auth = re_year.sub('', auth)
-    auth = re_born.sub('', auth)
-    auth = re_died.sub('', auth)
-    auth = auth.strip()
+    auth = _RE_YEARS.sub('', auth)
+    auth = _RE_BORN.sub('', auth)
+    auth = _RE_DIED.sub('', auth)
+    auth = sys.intern(auth.strip())
     res.append(Person(auth, year[0], year[1]))
   return res
 
 
 def _parse_voice(raw):
-  numero = int(re.search(r'^ *([0-9]*):', raw).group(1)) - 1
-  raw = re.sub(r'^ *([0-9]*):', '', raw)
   delimiter = ';' if ';' in raw else ','
   data = [i.strip() for i in raw.split(delimiter, 1) if i.strip()]
   if len(data) == 0:
-    return (numero, Voice(None, None))
+    return Voice(None, None)
   if data[0].count('--') == 1:
-    range = data[0]
-    name = data[1] if len(data) > 1 else None
+    range = sys.intern(data[0])
+    name = sys.intern(data[1]) if len(data) > 1 else None
   else:
     range = None
-    name = raw.strip()
-  return (numero, Voice(name, range))
+    name = sys.intern(raw.strip())
+  return Voice(name, range)
 
 
-def _merge_voice(old, new):
-  old = list(old if old else [])
-  while len(old) <= new[0]:
+def _merge_voice(old, numero, voice):
+  while len(old) <= numero:
     old.append(Voice(None, None))
-  old[new[0]] = new[1]
-  return old
+  old[numero] = voice
 
 
 def _parse_year(value):
-  match = re.search(r'[0-9]{4}', value)
+  match = _RE_YEAR.search(value)
   if match:
     return int(match.group(0))
   else:
     return None
 
 
-def _process_lines(lines):
-  commands = (('Print Number: ', 'print', int),
-              ('Composer: ', 'composer', _parse_people),
-              ('Title: ', 'title', str),
-              ('Genre: ', 'genre', str),
-              ('Key: ', 'key', str),
-              ('Composition Year: ', 'comp_year', _parse_year),
-              ('Publication Year: ', 'pub_year', _parse_year),
-              ('Edition: ', 'edition', str),
-              ('Editor: ', 'editor', _parse_people),
-              ('Voice ', 'voices', _parse_voice, _merge_voice),
-              ('Partiture:', 'partit', _parse_bool),
-              ('Incipit: ', 'incipit', str),)
-  lines = [i.strip() for i in lines if i.strip()]
-  processed = {}
+# Maps the field name (the part of the line before the first colon) to the
+# key in the processed record and the value parser.
+_FIELDS = {'Print Number': ('print', int),
+           'Composer': ('composer', _parse_people),
+           'Title': ('title', str),
+           'Genre': ('genre', sys.intern),
+           'Key': ('key', sys.intern),
+           'Composition Year': ('comp_year', _parse_year),
+           'Publication Year': ('pub_year', _parse_year),
+           'Edition': ('edition', sys.intern),
+           'Editor': ('editor', _parse_people),
+           'Partiture': ('partit', _parse_bool),
+           'Incipit': ('incipit', str)}
+
+
+def _share(shared, objs, key):
+  return [shared.setdefault(key(i), i) for i in objs]
+
+
+def _person_key(person):
+  return (Person, person.name, person.born, person.died)
+
+
+def _voice_key(voice):
+  return (Voice, voice.name, voice.range)
+
+
+def _parse_voices(raw):
+  voices = []
+  for numero, value in raw:
+    _merge_voice(voices, numero, _parse_voice(value))
+  return voices
+
+
+_PARSERS = dict(_FIELDS.values())
+_PARSERS['voices'] = _parse_voices
+# Identical people and voices are represented by a single shared instance.
+_SHARED = {'composer': _person_key, 'editor': _person_key,
+           'voices': _voice_key}
+
+
+def _parse_field(name, raw, shared):
+  value = _PARSERS[name](raw)
+  if shared is not None and name in _SHARED:
+    value = _share(shared, value, _SHARED[name])
+  return value
+
+
+def _split_lines(lines):
+  # Maps the field keys to their unparsed values; voices are kept as a list
+  # of (index, value) pairs.
+  raw = {}
   for line in lines:
-    for c in commands:
-      if line.startswith(c[0]):
-        data = line[len(c[0]):].strip()
-        pdata = c[2](data)
-        mergeFn = c[3] if len(c) == 4 else (lambda _, x: x)
-        processed[c[1]] = mergeFn(processed.get(c[1]), pdata)
-  if processed == {}:
+    line = line.strip()
+    key, sep, value = line.partition(':')
+    if not sep:
+      continue
+    field = _FIELDS.get(key)
+    if field is not None:
+      # Empty fields are skipped, only Partiture may lack the space.
+      if value.startswith(' ') or key == 'Partiture':
+        raw[field[0]] = value.strip()
+    elif key.startswith('Voice '):
+      try:
+        numero = int(key[6:]) - 1
+      except ValueError:
+        continue
+      raw.setdefault('voices', []).append((numero, value))
+  return raw
+
+
+def _process_lines(lines, shared=None):
+  raw = _split_lines(lines)
+  if raw == {}:
     return None
+  processed = {name: _parse_field(name, value, shared)
+               for name, value in raw.items()}
   return Print(Edition(Composition(processed.get('title'),
                                    processed.get('incipit'),
                                    processed.get('key'),
@@ -260,3 +570,589 @@ def _process_lines(lines):
                        processed.get('edition')),
                processed['print'],
                processed.get('partit'))
+
+
+def _process_lazy(lines, shared=None):
+  raw = _split_lines(lines)
+  if raw == {}:
+    return None
+  return LazyPrint(raw, shared)
+
+
+class _LazyRecord:
+  # The unparsed fields of a record; each is parsed on first use.
+  __slots__ = ('raw', 'parsed', 'shared')
+
+  def __init__(self, raw, shared):
+    self.raw = raw
+    self.parsed = {}
+    self.shared = shared
+
+  def get(self, name, default=None):
+    try:
+      return self.parsed[name]
+    except KeyError:
+      pass
+    value = self.raw.get(name)
+    if value is None:
+      value = default
+    else:
+      value = _parse_field(name, value, self.shared)
+      if isinstance(value, list):
+        value = tuple(value)
+    self.parsed[name] = value
+    return value
+
+
+def _lazy(name, default=None):
+  return property(lambda self: self._record.get(name, default))
+
+
+class LazyComposition(_CompositionBase):
+  __slots__ = ('_record',)
+
+  def __init__(self, record):
+    _set(self, '_record', record)
+
+  name = _lazy('title')
+  incipit = _lazy('incipit')
+  key = _lazy('key')
+  genre = _lazy('genre')
+  year = _lazy('comp_year')
+  voices = _lazy('voices', ())
+  authors = _lazy('composer', ())
+
+
+class LazyEdition(_EditionBase):
+  __slots__ = ('_record', 'composition')
+
+  def __init__(self, record):
+    _set(self, '_record', record)
+    _set(self, 'composition', LazyComposition(record))
+
+  authors = _lazy('editor', ())
+  name = property(lambda self: self._record.get('edition') or '')
+
+
+class LazyPrint(_PrintBase):
+  # Keeps the raw fields of the record and parses them only when they are
+  # accessed, so scans reading a few fields skip most of the parsing. It
+  # compares equal to the Print parsed from the same record.
+  __slots__ = ('_record', 'edition')
+
+  def __init__(self, raw, shared=None):
+    self._record = _LazyRecord(raw, shared)
+    self.edition = LazyEdition(self._record)
+
+  def __reduce__(self):
+    return (LazyPrint, (self._record.raw,))
+
+  print_id = _lazy('print')
+  partiture = property(lambda self: bool(self._record.get('partit')))
+
+
+# Binary snapshots of a parsed catalog. The file starts with a header and a
+# table of sections; every section is an array of little endian int64s
+# except for the UTF-8 string blob. Strings, people and voices are stored
+# once and referred to by their index, None is stored as _NONE.
+_SNAPSHOT_MAGIC = b'SCORESNP'
+_SNAPSHOT_VERSION = 1
+_SNAPSHOT_HEADER = struct.Struct('<8sIIqq')
+_SNAPSHOT_SECTIONS = ('string_offsets', 'strings', 'people', 'voices',
+                      'compositions', 'composition_voices',
+                      'composition_authors', 'editions', 'edition_authors',
+                      'prints')
+_SNAPSHOT_TABLE = struct.Struct('<' + 'qq' * len(_SNAPSHOT_SECTIONS))
+_NONE = -(1 << 63)
+# Number of int64 fields of one record in each of the record sections.
+_PERSON_FIELDS = 3       # name, born, died
+_VOICE_FIELDS = 2        # name, range
+# name, incipit, key, genre, year, voices start and count, authors start
+# and count
+_COMPOSITION_FIELDS = 9
+_EDITION_FIELDS = 4      # composition, name, authors start and count
+_PRINT_FIELDS = 3        # print id, partiture, edition
+_SORTED = 1
+
+
+def _source_stamp(source):
+  st = os.stat(source)
+  return st.st_size, st.st_mtime_ns
+
+
+class _SnapshotWriter:
+  # Compositions and editions are shared by identity rather than pub_key(),
+  # which would merge compositions whose voices differ only in order. The
+  # objects are kept alive in keep, so that the prints may come from an
+  # iterator without an id being reused.
+  def __init__(self):
+    self.strings = {}
+    self.string_list = []
+    self.people = {}
+    self.voices = {}
+    self.compositions = {}
+    self.editions = {}
+    self.keep = []
+    self.data = {name: array.array('q') for name in _SNAPSHOT_SECTIONS
+                 if name != 'strings'}
+
+  def string(self, value):
+    if value is None:
+      return _NONE
+    idx = self.strings.get(value)
+    if idx is None:
+      idx = self.strings[value] = len(self.string_list)
+      self.string_list.append(value)
+    return idx
+
+  def _append(self, section, fields):
+    data = self.data[section]
+    idx = len(data) // len(fields)
+    data.extend(fields)
+    return idx
+
+  def _intern(self, table, section, key, fields):
+    idx = table.get(key)
+    if idx is None:
+      idx = table[key] = self._append(section, fields)
+    return idx
+
+  def person(self, p):
+    return self._intern(self.people, 'people', _person_key(p),
+                        (self.string(p.name), _int(p.born), _int(p.died)))
+
+  def voice(self, v):
+    return self._intern(self.voices, 'voices', _voice_key(v),
+                        (self.string(v.name), self.string(v.range)))
+
+  def _refs(self, section, idxs):
+    data = self.data[section]
+    start = len(data)
+    data.extend(idxs)
+    return start, len(idxs)
+
+  def composition(self, c):
+    idx = self.compositions.get(id(c))
+    if idx is None:
+      fields = (self.string(c.name), self.string(c.incipit),
+                self.string(c.key), self.string(c.genre), _int(c.year))
+      fields += self._refs('composition_voices',
+                           [self.voice(v) for v in c.voices])
+      fields += self._refs('composition_authors',
+                           [self.person(p) for p in c.authors])
+      idx = self.compositions[id(c)] = self._append('compositions', fields)
+      self.keep.append(c)
+    return idx
+
+  def edition(self, e):
+    idx = self.editions.get(id(e))
+    if idx is None:
+      fields = (self.composition(e.composition), self.string(e.name))
+      fields += self._refs('edition_authors',
+                           [self.person(p) for p in e.authors])
+      idx = self.editions[id(e)] = self._append('editions', fields)
+      self.keep.append(e)
+    return idx
+
+  def add(self, p):
+    self.data['prints'].extend((p.print_id, 1 if p.partiture else 0,
+                                self.edition(p.edition)))
+
+  def sections(self):
+    offsets = array.array('q', [0])
+    blobs = []
+    for s in self.string_list:
+      blob = s.encode('utf-8')
+      blobs.append(blob)
+      offsets.append(offsets[-1] + len(blob))
+    self.data['string_offsets'] = offsets
+    strings = b''.join(blobs)
+    for name in _SNAPSHOT_SECTIONS:
+      if name == 'strings':
+        yield name, strings + b'\0' * (-len(strings) % 8), len(strings)
+      else:
+        data = self.data[name]
+        if sys.byteorder != 'little':
+          data.byteswap()
+        yield name, data.tobytes(), len(data)
+
+
+def _int(value):
+  return _NONE if value is None else value
+
+
+def save_snapshot(prints, path, source, sorted=True, stamp=None):
+  # The snapshot is stamped with the size and mtime of the source, or with
+  # the stamp taken before the prints were read from it.
+  writer = _SnapshotWriter()
+  for p in prints:
+    writer.add(p)
+  size, mtime = stamp if stamp is not None else _source_stamp(source)
+  sections = list(writer.sections())
+  offset = _SNAPSHOT_HEADER.size + _SNAPSHOT_TABLE.size
+  offset += -offset % 8
+  table = []
+  for _, blob, count in sections:
+    table += [offset, count]
+    offset += len(blob)
+  tmp = path + '.tmp'
+  with open(tmp, 'wb') as f:
+    f.write(_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION,
+                                  _SORTED if sorted else 0, size, mtime))
+    f.write(_SNAPSHOT_TABLE.pack(*table))
+    f.write(b'\0' * (table[0] - f.tell()))
+    for _, blob, _ in sections:
+      f.write(blob)
+  os.replace(tmp, path)
+
+
+class Snapshot(collections.abc.Sequence):
+  # A memory-mapped snapshot; the prints and the objects they refer to are
+  # created on first access and then shared. close() (or a with statement)
+  # unmaps the file; the prints already created stay valid.
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    self._view = None
+    self._sections = {}
+    try:
+      self._open(path)
+    except Exception:
+      self.close()
+      raise
+
+  def _open(self, path):
+    (magic, version, flags, self.source_size,
+     self.source_mtime) = _SNAPSHOT_HEADER.unpack_from(self._map)
+    if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+      raise ValueError('{} is not a scorelib snapshot'.format(path))
+    self.sorted = bool(flags & _SORTED)
+    table = _SNAPSHOT_TABLE.unpack_from(self._map, _SNAPSHOT_HEADER.size)
+    view = self._view = memoryview(self._map)
+    for idx, name in enumerate(_SNAPSHOT_SECTIONS):
+      offset, count = table[2 * idx], table[2 * idx + 1]
+      size = count if name == 'strings' else 8 * count
+      if offset < 0 or count < 0 or offset + size > len(self._map):
+        raise ValueError('{} is truncated: section {} ends past the end '
+                         'of the file'.format(path, name))
+      if name == 'strings':
+        self._sections[name] = view[offset:offset + count]
+      else:
+        section = view[offset:offset + 8 * count].cast('q')
+        if sys.byteorder != 'little':
+          section = array.array('q', section)
+          section.byteswap()
+        self._sections[name] = section
+    self._cache = {name: {} for name in _SNAPSHOT_SECTIONS}
+
+  def close(self):
+    # The views into the map have to be released before it can be closed.
+    for section in self._sections.values():
+      if isinstance(section, memoryview):
+        section.release()
+    self._sections = {}
+    if self._view is not None:
+      self._view.release()
+      self._view = None
+    self._map.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def __len__(self):
+    return len(self._sections['prints']) // _PRINT_FIELDS
+
+  def __getitem__(self, idx):
+    if isinstance(idx, slice):
+      return [self[i] for i in range(*idx.indices(len(self)))]
+    if idx < 0:
+      idx += len(self)
+    if not 0 <= idx < len(self):
+      raise IndexError('snapshot index out of range')
+    data = self._sections['prints']
+    base = idx * _PRINT_FIELDS
+    return Print(self._edition(data[base + 2]), data[base],
+                 bool(data[base + 1]))
+
+  def _record(self, section, idx, size):
+    base = idx * size
+    return self._sections[section][base:base + size]
+
+  def _cached(self, section, idx, make):
+    cache = self._cache[section]
+    obj = cache.get(idx)
+    if obj is None:
+      obj = cache[idx] = make(idx)
+    return obj
+
+  def _string(self, idx):
+    if idx == _NONE:
+      return None
+    return self._cached('strings', idx, self._make_string)
+
+  def _make_string(self, idx):
+    offsets = self._sections['string_offsets']
+    return str(self._sections['strings'][offsets[idx]:offsets[idx + 1]],
+               'utf-8')
+
+  def _refs(self, section, start, count, make):
+    refs = self._sections[section][start:start + count]
+    return [make(i) for i in refs]
+
+  def _person(self, idx):
+    return self._cached('people', idx, self._make_person)
+
+  def _make_person(self, idx):
+    name, born, died = self._record('people', idx, _PERSON_FIELDS)
+    return Person(self._string(name), _value(born), _value(died))
+
+  def _voice(self, idx):
+    return self._cached('voices', idx, self._make_voice)
+
+  def _make_voice(self, idx):
+    name, range = self._record('voices', idx, _VOICE_FIELDS)
+    return Voice(self._string(name), self._string(range))
+
+  def _composition(self, idx):
+    return self._cached('compositions', idx, self._make_composition)
+
+  def _make_composition(self, idx):
+    (name, incipit, key, genre, year, voices_start, voices_count,
+     authors_start, authors_count) = self._record('compositions', idx,
+                                                  _COMPOSITION_FIELDS)
+    return Composition(self._string(name), self._string(incipit),
+                       self._string(key), self._string(genre), _value(year),
+                       self._refs('composition_voices', voices_start,
+                                  voices_count, self._voice),
+                       self._refs('composition_authors', authors_start,
+                                  authors_count, self._person))
+
+  def _edition(self, idx):
+    return self._cached('editions', idx, self._make_edition)
+
+  def _make_edition(self, idx):
+    composition, name, authors_start, authors_count = self._record(
+        'editions', idx, _EDITION_FIELDS)
+    return Edition(self._composition(composition),
+                   self._refs('edition_authors', authors_start,
+                              authors_count, self._person),
+                   self._string(name))
+
+
+def _value(value):
+  return None if value == _NONE else value
+
+
+def load_snapshot(path, source=None):
+  # Returns None if the snapshot is out of date with the source file.
+  snapshot = Snapshot(path)
+  if source is not None and \
+      (snapshot.source_size, snapshot.source_mtime) != _source_stamp(source):
+    snapshot.close()
+    return None
+  return snapshot
+
+
+class _Codes:
+  # Dictionary encoding of the values of one column.
+  def __init__(self):
+    self.codes = {}
+    self.values = []
+
+  def code(self, value):
+    if value is None:
+      return -1
+    code = self.codes.get(value)
+    if code is None:
+      code = self.codes[value] = len(self.values)
+      self.values.append(value)
+    return code
+
+
+class Columns:
+  # A struct-of-arrays view of a list of prints for vectorized analytics.
+  # Missing years and categories are stored as -1. A print may have more
+  # than one composer: composer holds the code of the first one, all of
+  # them are in composer_codes, with composer_rows giving the row of each.
+  def __init__(self, prints):
+    if np is None:
+      raise ImportError('Columns requires numpy')
+    genres, keys, composers = _Codes(), _Codes(), _Codes()
+    ids, years, partitures, voices = [], [], [], []
+    genre, key, composer = [], [], []
+    composer_rows, composer_codes = [], []
+    for row, p in enumerate(prints):
+      c = p.composition()
+      ids.append(p.print_id)
+      years.append(c.year if c.year is not None else -1)
+      partitures.append(bool(p.partiture))
+      voices.append(len(c.voices))
+      genre.append(genres.code(c.genre))
+      key.append(keys.code(c.key))
+      codes = [composers.code(a.name) for a in c.authors]
+      composer.append(codes[0] if codes else -1)
+      composer_rows.extend([row] * len(codes))
+      composer_codes.extend(codes)
+    self.print_id = np.array(ids, dtype=np.int64)
+    self.year = np.array(years, dtype=np.int32)
+    self.partiture = np.array(partitures, dtype=np.bool_)
+    self.voices = np.array(voices, dtype=np.int32)
+    self.genre = np.array(genre, dtype=np.int32)
+    self.key = np.array(key, dtype=np.int32)
+    self.composer = np.array(composer, dtype=np.int32)
+    self.composer_rows = np.array(composer_rows, dtype=np.int64)
+    self.composer_codes = np.array(composer_codes, dtype=np.int32)
+    self.genres = genres.values
+    self.keys = keys.values
+    self.composers = composers.values
+
+  def __len__(self):
+    return len(self.print_id)
+
+  def century(self):
+    # Same as year_to_century in 01_regex/stat.py; -1 for unknown years.
+    return np.where(self.year > 0, (self.year - 1) // 100 + 1, -1)
+
+  def count_by_century(self):
+    centuries = self.century()
+    centuries = centuries[centuries > 0]
+    counts = np.bincount(centuries)
+    return {int(c): int(counts[c]) for c in np.flatnonzero(counts)}
+
+  def _count_codes(self, codes, values):
+    counts = np.bincount(codes[codes >= 0], minlength=len(values))
+    return {values[c]: int(counts[c]) for c in np.flatnonzero(counts)}
+
+  def count_by_genre(self):
+    return self._count_codes(self.genre, self.genres)
+
+  def count_by_key(self):
+    return self._count_codes(self.key, self.keys)
+
+  def count_by_composer(self):
+    # Every composer of a print is counted.
+    return self._count_codes(self.composer_codes, self.composers)
+
+
+_RE_TOKEN = re.compile(r'\w+')
+
+
+def _tokens(text):
+  return _RE_TOKEN.findall(text.lower()) if text else []
+
+
+def _key_tokens(text):
+  # Case matters in keys (C is major, c minor), so they are kept as they are.
+  text = text.strip() if text else ''
+  return [text] if text else []
+
+
+class CatalogIndex:
+  # An inverted index mapping the tokens of some fields of the prints to
+  # sorted arrays of print ids. Terms are (field, token) pairs; a token
+  # ending with '*' matches every token with that prefix. ids(), all() and
+  # any() return read-only memoryviews of the sorted int64 ids, which may
+  # be the index's own arrays.
+  FIELDS = {'composer': lambda p: [t for a in p.composition().authors
+                                   for t in _tokens(a.name)],
+            'title': lambda p: _tokens(p.composition().name),
+            'genre': lambda p: _tokens(p.composition().genre),
+            'key': lambda p: _key_tokens(p.composition().key)}
+
+  def __init__(self, prints):
+    postings = {field: {} for field in self.FIELDS}
+    for p in prints:
+      for field, tokens in self.FIELDS.items():
+        index = postings[field]
+        for token in tokens(p):
+          index.setdefault(token, []).append(p.print_id)
+    self._postings = {}
+    self._tokens = {}
+    for field, index in postings.items():
+      self._postings[field] = {token: array.array('q', sorted(set(ids)))
+                               for token, ids in index.items()}
+      self._tokens[field] = sorted(index)
+
+  def tokens(self, field, prefix=''):
+    tokens = self._tokens[field]
+    for idx in range(bisect.bisect_left(tokens, prefix), len(tokens)):
+      if not tokens[idx].startswith(prefix):
+        break
+      yield tokens[idx]
+
+  def _normalize(self, field, token):
+    return token if field == 'key' else token.lower()
+
+  def _lookup(self, field, token):
+    if token.endswith('*'):
+      prefix = self._normalize(field, token[:-1])
+      postings = self._postings[field]
+      return _union([postings[t] for t in self.tokens(field, prefix)])
+    return self._postings[field].get(self._normalize(field, token),
+                                     array.array('q'))
+
+  def ids(self, field, token):
+    return memoryview(self._lookup(field, token)).toreadonly()
+
+  def all(self, *terms):
+    # Print ids matching all the terms.
+    return memoryview(_intersection([self._lookup(field, token)
+                                     for field, token in terms])).toreadonly()
+
+  def any(self, *terms):
+    # Print ids matching at least one of the terms.
+    return memoryview(_union([self._lookup(field, token)
+                              for field, token in terms])).toreadonly()
+
+
+def _union(postings):
+  if len(postings) == 1:
+    return postings[0]
+  if np is not None and postings:
+    # The concatenated lists are sorted runs, which a stable sort merges;
+    # then the repeated ids are dropped.
+    ids = np.sort(np.concatenate([np.frombuffer(p, dtype=np.int64)
+                                  for p in postings]), kind='stable')
+    keep = np.empty(len(ids), dtype=bool)
+    keep[:1] = True
+    np.not_equal(ids[1:], ids[:-1], out=keep[1:])
+    return array.array('q', ids[keep].tobytes())
+  return array.array('q', sorted(set().union(*postings)))
+
+
+def _intersection(postings):
+  if not postings:
+    return array.array('q')
+  postings = sorted(postings, key=len)
+  if len(postings) == 1:
+    return postings[0]
+  if np is not None:
+    res = np.frombuffer(postings[0], dtype=np.int64)
+    for other in postings[1:]:
+      if not len(res):
+        break
+      # Binary search for every id of the shorter list in the longer one.
+      other = np.frombuffer(other, dtype=np.int64)
+      found = np.searchsorted(other, res)
+      found[found == len(other)] = 0
+      res = res[other[found] == res]
+    return array.array('q', res.tobytes())
+  res = postings[0]
+  for other in postings[1:]:
+    if len(res) * 16 < len(other):
+      # Much shorter: gallop through the longer list with bisect, each
+      # search starting where the previous one ended.
+      matches, lo, end = [], 0, len(other)
+      for i in res:
+        lo = bisect.bisect_left(other, i, lo)
+        if lo == end:
+          break
+        if other[lo] == i:
+          matches.append(i)
+    else:
+      matches = sorted(set(res).intersection(other))
+    res = array.array('q', matches)
+  return res
@@ -0,0 +1,271 @@
+try:
+  from .scorelib import *
+except ImportError:
+  from scorelib import *
+
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import unittest
+from collections import Counter
+from unittest import mock
+
+SCORELIB = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir, '01_regex', 'scorelib.txt')
+
+
+class TestLoad(unittest.TestCase):
+
+  def test_parallel_load(self):
+    expected = load(SCORELIB)
+    prints = load(SCORELIB, workers=3)
+    self.assertEqual(len(prints), 873)
+    self.assertEqual(prints, expected)
+    self.assertEqual([str(p) for p in prints], [str(p) for p in expected])
+
+  def test_parallel_load_keeps_file_order(self):
+    self.assertEqual(load(SCORELIB, sort=False, workers=2),
+                     load(SCORELIB, sort=False))
+
+  def test_chunks(self):
+    chunks = list(iter_chunks(SCORELIB, 5))
+    self.assertEqual(len(chunks), 5)
+    self.assertEqual([p for start, end in chunks
+                      for p in load_chunk(SCORELIB, start, end)],
+                     load(SCORELIB, sort=False))
+
+
+class TestModel(unittest.TestCase):
+
+  def test_shared_people_and_voices(self):
+    for lazy in (False, True):
+      people = {}
+      voices = {}
+      for p in load(SCORELIB, lazy=lazy):
+        c = p.composition()
+        for person in c.authors + p.edition.authors:
+          key = (person.name, person.born, person.died)
+          self.assertIs(people.setdefault(key, person), person)
+        for voice in c.voices:
+          self.assertIs(voices.setdefault((voice.name, voice.range), voice),
+                        voice)
+      self.assertTrue(people and voices)
+
+  def test_slots(self):
+    p = load(SCORELIB)[0]
+    for obj in (p, p.edition, p.composition(), p.composition().authors[0],
+                p.composition().voices[0]):
+      self.assertFalse(hasattr(obj, '__dict__'), type(obj).__name__)
+
+  def test_immutable(self):
+    p = load(SCORELIB)[0]
+    for obj in (p.edition, p.composition()):
+      with self.assertRaises(AttributeError):
+        obj.name = 'changed'
+      with self.assertRaises(AttributeError):
+        del obj.name
+    self.assertEqual(p.composition().name, load(SCORELIB)[0].composition().name)
+
+  def test_cached_hash(self):
+    for lazy in (False, True):
+      for p in load(SCORELIB, lazy=lazy)[:50]:
+        for obj in (p.edition, p.composition()):
+          self.assertEqual(hash(obj), hash(obj.pub_key()))
+          self.assertIs(obj.pub_key(), obj.pub_key())
+          self.assertEqual(hash(obj), hash(obj))
+
+
+class TestLazy(unittest.TestCase):
+
+  def test_equal_to_eager(self):
+    eager = load(SCORELIB)
+    lazy = load(SCORELIB, lazy=True)
+    self.assertEqual(lazy, eager)
+    self.assertEqual(eager, lazy)
+    self.assertEqual(set(lazy), set(eager))
+    self.assertEqual([str(p) for p in lazy], [str(p) for p in eager])
+
+  def test_parse_on_access(self):
+    expected = [(p.print_id, p.composition().authors, p.composition().year)
+                for p in load(SCORELIB)]
+    module = sys.modules[Print.__module__]
+    with mock.patch.object(module, '_parse_voice',
+                           side_effect=AssertionError('voice parsed')):
+      prints = load(SCORELIB, lazy=True)
+      self.assertEqual([(p.print_id, p.composition().authors,
+                         p.composition().year) for p in prints], expected)
+
+
+class TestSnapshot(unittest.TestCase):
+
+  def setUp(self):
+    tmp = tempfile.TemporaryDirectory()
+    self.addCleanup(tmp.cleanup)
+    self.source = os.path.join(tmp.name, 'scorelib.txt')
+    self.snapshot = os.path.join(tmp.name, 'scorelib.snap')
+    with open(SCORELIB, encoding='utf-8') as f:
+      self.text = f.read()
+    with open(self.source, 'w', encoding='utf-8') as f:
+      f.write(self.text)
+    self.expected = load(self.source)
+
+  def test_round_trip(self):
+    for _ in range(2):
+      # Written on the first load, read on the second.
+      with load(self.source, snapshot=self.snapshot) as snapshot:
+        self.assertIsInstance(snapshot, Snapshot)
+        self.assertEqual(list(snapshot), self.expected)
+
+  def test_save_from_iterator(self):
+    expected = load(self.source, sort=False)
+    for lazy in (False, True):
+      save_snapshot(iter_prints(self.source, lazy), self.snapshot,
+                    self.source, sorted=False)
+      with Snapshot(self.snapshot) as snapshot:
+        self.assertEqual(list(snapshot), expected)
+
+  def test_changed_source(self):
+    save_snapshot(self.expected, self.snapshot, self.source)
+    with open(self.source, 'a', encoding='utf-8') as f:
+      f.write('\n')
+    self.assertIsNone(load_snapshot(self.snapshot, self.source))
+
+  def test_source_edited_while_parsing(self):
+    edited = self.text.replace('Title: Christmass Oratorio',
+                               'Title: Christmas Oratorio', 1)
+    module = sys.modules[Print.__module__]
+    parse = module.iter_prints
+
+    def parse_then_edit(*args):
+      prints = list(parse(*args))
+      with open(self.source, 'w', encoding='utf-8') as f:
+        f.write(edited + '\n')
+      return prints
+    with mock.patch.object(module, 'iter_prints', parse_then_edit):
+      load(self.source, snapshot=self.snapshot).close()
+    with load(self.source, snapshot=self.snapshot) as snapshot:
+      self.assertEqual(list(snapshot), load(self.source))
+
+  def test_corrupt_snapshot(self):
+    save_snapshot(self.expected, self.snapshot, self.source)
+    with open(self.snapshot, 'r+b') as f:
+      f.truncate(os.path.getsize(self.snapshot) // 2)
+    with self.assertRaises(ValueError):
+      Snapshot(self.snapshot)
+    with load(self.source, snapshot=self.snapshot) as snapshot:
+      self.assertEqual(list(snapshot), self.expected)
+    with load(self.source, snapshot=self.snapshot) as snapshot:
+      self.assertEqual(list(snapshot), self.expected)
+
+
+class TestIncrementalLoader(unittest.TestCase):
+
+  def test_reparse_changed_records(self):
+    with open(SCORELIB, encoding='utf-8') as f:
+      text = f.read()
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'scorelib.txt')
+      with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+      loader = IncrementalLoader(path)
+      prints, changes = loader.load()
+      self.assertEqual(prints, load(path))
+      self.assertEqual(len(changes.added), len(prints))
+      prints, changes = loader.load()
+      self.assertEqual(changes, Changes([], [], []))
+      self.assertEqual(loader.reparsed, 0)
+      text = text.replace('Print Number: 1\n', 'Print Number: 1000\n', 1)
+      text = text.replace('Title: Christmass Oratorio',
+                          'Title: Christmas Oratorio', 1)
+      with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+      prints, changes = loader.load()
+      self.assertEqual(changes, Changes([1000], [1], [0]))
+      self.assertEqual(loader.reparsed, 2)
+      self.assertEqual(prints, load(path))
+
+
+class TestWrite(unittest.TestCase):
+
+  def test_write_prints_round_trip(self):
+    prints = load(SCORELIB)
+    out = io.StringIO()
+    write_prints(prints, out)
+    self.assertEqual(out.getvalue(), ''.join(str(p) + '\n' for p in prints))
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'scorelib.txt')
+      with open(path, 'w', encoding='utf-8') as f:
+        f.write(out.getvalue())
+      self.assertEqual(load(path), prints)
+
+  def test_write_prints_json(self):
+    prints = load(SCORELIB)
+    out = io.StringIO()
+    write_prints_json(prints, out)
+    lines = out.getvalue().splitlines()
+    self.assertEqual(len(lines), len(prints))
+    self.assertEqual(json.loads(lines[0]), prints[0].to_json())
+
+
+class TestCatalogIndex(unittest.TestCase):
+
+  def test_queries(self):
+    prints = load(SCORELIB)
+    index = CatalogIndex(prints)
+    bach = [p.print_id for p in prints
+            if any('bach' in re.findall(r'\w+', a.name.lower())
+                   for a in p.composition().authors)]
+    self.assertEqual(list(index.ids('composer', 'Bach')), bach)
+    self.assertEqual(list(index.ids('composer', 'bac*')), bach)
+    cantatas = set(index.ids('genre', 'cantata'))
+    self.assertEqual(list(index.all(('composer', 'bach'), ('genre', 'cantata'))),
+                     [i for i in bach if i in cantatas])
+    self.assertEqual(set(index.any(('key', 'C'), ('key', 'c'))),
+                     {p.print_id for p in prints
+                      if p.composition().key in ('C', 'c')})
+    self.assertEqual(list(index.ids('title', 'nonexistent')), [])
+
+  def test_results_are_read_only(self):
+    index = CatalogIndex(load(SCORELIB))
+    for ids in (index.ids('composer', 'bach'), index.ids('composer', 'bac*'),
+                index.all(('composer', 'bach')), index.any(('composer', 'bach'))):
+      with self.assertRaises(TypeError):
+        ids[0] = 0
+    self.assertEqual(index.ids('composer', 'bach')[0],
+                     index.all(('composer', 'bach'), ('composer', 'bach'))[0])
+
+  def test_merges(self):
+    index = CatalogIndex(load(SCORELIB))
+    terms = [('composer', 'j*'), ('key', 'C'), ('genre', 'cantata'),
+             ('composer', 'johann'), ('title', 'nonexistent')]
+    sets = [set(index.ids(*term)) for term in terms]
+    for count in range(1, len(terms) + 1):
+      self.assertEqual(list(index.all(*terms[:count])),
+                       sorted(set.intersection(*sets[:count])))
+      self.assertEqual(list(index.any(*terms[:count])),
+                       sorted(set.union(*sets[:count])))
+
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestColumns(unittest.TestCase):
+
+  def test_counts(self):
+    prints = load(SCORELIB)
+    cols = Columns(prints)
+    self.assertEqual(len(cols), len(prints))
+    self.assertEqual(cols.count_by_genre(),
+                     Counter(p.composition().genre for p in prints
+                             if p.composition().genre is not None))
+    self.assertEqual(cols.count_by_composer(),
+                     Counter(a.name for p in prints
+                             for a in p.composition().authors))
+    self.assertEqual(cols.count_by_century()[18],
+                     sum(1 for p in prints if p.composition().year
+                         and 1701 <= p.composition().year <= 1800))
+
+
+if __name__ == '__main__':
+  unittest.main()
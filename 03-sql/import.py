@@ -1,30 +1,64 @@
 #!/usr/bin/env python3
 
+import argparse
+import hashlib
+import multiprocessing
+import os
 import sys
 import re
 import sqlite3
+import time
 import scorelib
-from collections import defaultdict
+from collections import defaultdict, deque
+from itertools import islice
 
 INIT_SCRIPT = 'scorelib.sql'
+BATCH_SIZE = 10000
+# Used for the duration of a bulk import only; a crash during the import
+# may corrupt the database, which is then simply imported again.
+BULK_PRAGMAS = ('PRAGMA journal_mode = WAL',
+                'PRAGMA synchronous = OFF',
+                'PRAGMA cache_size = -262144',
+                'PRAGMA temp_store = MEMORY')
+# Size of the chunks the pipelined import parses, in bytes of the input.
+PIPELINE_CHUNK = 1 << 20
+PIPELINE_QUEUE = 8
+UPDATE_COUNTS = ('added', 'changed', 'removed', 'orphan editions', 'orphan scores', 'orphan people', 'people dates')
 
-def loadPeople(prints):
-  people = defaultdict(lambda : [])
+def mergeDates(dates, p):
+  # Folds the people of one print into the running [born, died] of each
+  # name, where the last mention that has a date wins. Returns the number
+  # of mentions.
+  mentions = 0
+  for people in (p.edition.authors, p.composition().authors):
+    mentions += len(people)
+    for person in people:
+      record = dates.get(person.name)
+      if record is None:
+        dates[person.name] = [person.born or None, person.died or None]
+      else:
+        if person.born:
+          record[0] = person.born
+        if person.died:
+          record[1] = person.died
+  return mentions
+
+
+def loadPeople(prints, stats=None):
+  dates = {}
+  mentions = 0
   for p in prints:
-    for person in p.edition.authors:
-      people[person.name].append(person)
-    for person in p.composition().authors:
-      people[person.name].append(person)
-  peopleset = set()
-  for personname in people.keys():
-    born, died = None, None
-    for p in people[personname]:
-      if p.born:
-        born = p.born
-      if p.died:
-        died = p.died
-    peopleset.add(scorelib.Person(personname, born, died))
-  return peopleset
+    mentions += mergeDates(dates, p)
+  if stats is not None:
+    stats['mentions'] += mentions
+    stats['people'] += len(dates)
+  return [scorelib.Person(name, born, died) for name, (born, died) in dates.items()]
+
+
+def reportPeople(stats, out=None):
+  out = out if out is not None else sys.stderr
+  out.write('people: {} mentions of {} unique people ({:.1f} mentions per person)\n'.format(
+    stats['mentions'], stats['people'], stats['mentions'] / stats['people'] if stats['people'] else 0))
 
 def storePeople(connection, people, ids):
   cursor = connection.cursor()
@@ -107,12 +141,528 @@ def storeComposerLinks(connection, links, ids):
     cursor.execute('INSERT INTO score_author (score, composer) VALUES (?, ?)', key)
 
 
-def main(args):
-  prints = scorelib.load(args[0])
+def executeBatches(cursor, sql, rows):
+  rows = iter(rows)
+  while True:
+    batch = list(islice(rows, BATCH_SIZE))
+    if not batch:
+      return
+    cursor.executemany(sql, batch)
+
+
+# The bulk import stores the same rows as the functions above, but assigns
+# the ids itself instead of reading lastrowid and inserts with executemany.
+def storePeopleBulk(cursor, people, ids):
+  rows = []
+  for idx, p in enumerate(people, 1):
+    ids[p] = idx
+    rows.append((idx, p.name, p.born, p.died))
+  executeBatches(cursor, 'INSERT INTO person (id, name, born, died) VALUES (?, ?, ?, ?)', rows)
+
+
+def storeCompositionsBulk(cursor, compositions, ids):
+  keys = {}
+  rows = []
+  for c in compositions:
+    score_id = keys.get(c.pub_key())
+    if score_id is None:
+      score_id = keys[c.pub_key()] = len(keys) + 1
+      rows.append((score_id, c.name, c.genre, c.key, c.incipit, c.year))
+    ids[c] = score_id
+  executeBatches(cursor, 'INSERT INTO score (id, name, genre, key, incipit, year) VALUES (?, ?, ?, ?, ?, ?)', rows)
+  executeBatches(cursor, 'INSERT INTO voice (score, number, range, name) VALUES (?, ?, ?, ?)',
+                 ((ids[c], idx + 1, v.range, v.name) for c in compositions for idx, v in enumerate(c.voices)))
+
+
+def storeEditionsBulk(cursor, editions, ids):
+  keys = {}
+  rows = []
+  for e in editions:
+    edition_id = keys.get(e.pub_key())
+    if edition_id is None:
+      edition_id = keys[e.pub_key()] = len(keys) + 1
+      rows.append((edition_id, e.name, ids[e.composition]))
+    ids[e] = edition_id
+  executeBatches(cursor, 'INSERT INTO edition (id, name, score) VALUES (?, ?, ?)', rows)
+
+
+def storePrintsBulk(cursor, prints, ids):
+  unique = set((p.print_id, 'Y' if p.partiture else 'N', ids[p.edition]) for p in prints)
+  executeBatches(cursor, 'INSERT INTO print (id, partiture, edition) VALUES (?, ?, ?)', unique)
+
+
+def storeEditorLinksBulk(cursor, links, ids):
+  keys = set(((ids[link[0]], ids[link[1]]) for link in links))
+  executeBatches(cursor, 'INSERT INTO edition_author (edition, editor) VALUES (?, ?)', keys)
+
+
+def storeComposerLinksBulk(cursor, links, ids):
+  keys = set(((ids[link[0]], ids[link[1]]) for link in links))
+  executeBatches(cursor, 'INSERT INTO score_author (score, composer) VALUES (?, ?)', keys)
+
+
+def importBulk(connection, prints, stats=None):
+  connection.isolation_level = None
+  for pragma in BULK_PRAGMAS:
+    connection.execute(pragma)
+  ids = {}
+  cursor = connection.cursor()
+  cursor.execute('BEGIN')
+  try:
+    storePeopleBulk(cursor, loadPeople(prints, stats), ids)
+    storeCompositionsBulk(cursor, loadCompositions(prints), ids)
+    storeEditionsBulk(cursor, loadEditions(prints), ids)
+    storePrintsBulk(cursor, prints, ids)
+    storeEditorLinksBulk(cursor, loadEditorLinks(prints), ids)
+    storeComposerLinksBulk(cursor, loadComposerLinks(prints), ids)
+  except BaseException:
+    cursor.execute('ROLLBACK')
+    raise
+  cursor.execute('COMMIT')
+  # Leave the database in the default single file mode.
+  connection.execute('PRAGMA journal_mode = DELETE')
+
+
+# The streaming and incremental imports find existing rows by a digest of
+# their key instead of the ids dict. The digests are kept in the database,
+# so that a later incremental import can compare against them.
+KEY_TABLES = '''
+create table IF NOT EXISTS import_key ( kind char(1) not null, -- P = person, S = score, E = edition
+                          digest blob not null,
+                          id integer not null,
+                          primary key ( kind, digest ) ) WITHOUT ROWID;
+create index IF NOT EXISTS import_key_id on import_key ( kind, id );
+create table IF NOT EXISTS import_print ( id integer primary key not null,
+                            digest blob not null,
+                            copies integer default 1 not null ); -- occurrences, each with its own voice rows
+create table IF NOT EXISTS import_voice ( voice integer primary key not null,
+                            print integer not null ); -- the print that stored the voice row
+create index IF NOT EXISTS import_voice_print on import_voice ( print );
+'''
+# search.py and the incremental import follow the references from both
+# sides, which without these is a table scan for every row. They are created
+# once the rows are stored, as keeping them up to date slows down the import.
+REFERENCE_INDEXES = '''
+create index IF NOT EXISTS voice_score on voice ( score );
+create index IF NOT EXISTS edition_score on edition ( score );
+create index IF NOT EXISTS print_edition on print ( edition );
+create index IF NOT EXISTS score_author_score on score_author ( score );
+create index IF NOT EXISTS score_author_composer on score_author ( composer );
+create index IF NOT EXISTS edition_author_edition on edition_author ( edition );
+create index IF NOT EXISTS edition_author_editor on edition_author ( editor );
+'''
+# A trigram index over the person names, which search.py uses for its
+# substring match. The triggers keep it in sync with later changes.
+PERSON_FTS = '''
+create virtual table IF NOT EXISTS person_fts using fts5 ( name, content = 'person', content_rowid = 'id', tokenize = 'trigram' );
+insert into person_fts ( person_fts ) values ( 'rebuild' );
+create trigger IF NOT EXISTS person_fts_insert after insert on person begin
+  insert into person_fts ( rowid, name ) values ( new.id, new.name );
+end;
+create trigger IF NOT EXISTS person_fts_delete after delete on person begin
+  insert into person_fts ( person_fts, rowid, name ) values ( 'delete', old.id, old.name );
+end;
+create trigger IF NOT EXISTS person_fts_update after update of name on person begin
+  insert into person_fts ( person_fts, rowid, name ) values ( 'delete', old.id, old.name );
+  insert into person_fts ( rowid, name ) values ( new.id, new.name );
+end;
+'''
+
+def keyDigest(key):
+  return hashlib.sha1(repr(key).encode('utf-8')).digest()
+
+
+def compositionKey(name, incipit, key, genre, year, voices, authors):
+  # Same fields as Composition.pub_key, with the sets made canonical.
+  return (name, incipit, key, genre, year,
+          sorted(set(repr((v_name, v_range)) for v_name, v_range in voices)),
+          sorted(set(authors)))
+
+
+def printDigests(p):
+  c = p.composition()
+  score_key = keyDigest(compositionKey(c.name, c.incipit, c.key, c.genre, c.year,
+                                       ((v.name, v.range) for v in c.voices),
+                                       (a.name for a in c.authors)))
+  edition_key = keyDigest((score_key, sorted(set(a.name for a in p.edition.authors)), p.edition.name))
+  return score_key, edition_key, keyDigest(('Y' if p.partiture else 'N', edition_key))
+
+
+def lookupId(cursor, kind, digest):
+  row = cursor.execute('SELECT id FROM import_key WHERE kind = ? AND digest = ?', (kind, digest)).fetchone()
+  return row[0] if row else None
+
+
+def rememberId(cursor, kind, digest, id):
+  cursor.execute('INSERT INTO import_key (kind, digest, id) VALUES (?, ?, ?)', (kind, digest, id))
+
+
+def streamPerson(cursor, person):
+  digest = keyDigest(person.name)
+  person_id = lookupId(cursor, 'P', digest)
+  if person_id is None:
+    cursor.execute('INSERT INTO person (name, born, died) VALUES (?, ?, ?)', (person.name, person.born, person.died))
+    rememberId(cursor, 'P', digest, cursor.lastrowid)
+    return cursor.lastrowid
+  # Like loadPeople, the last mention that has a date wins.
+  if person.born:
+    cursor.execute('UPDATE person SET born = ? WHERE id = ?', (person.born, person_id))
+  if person.died:
+    cursor.execute('UPDATE person SET died = ? WHERE id = ?', (person.died, person_id))
+  return person_id
+
+
+def storeVoices(cursor, score_id, p):
+  # Like storeCompositions, every occurrence of a print, repeated ones
+  # included, stores its own copy of the voices. The prints of a score may
+  # list different voices, so import_voice records which print stored which
+  # rows.
+  voice_ids = []
+  for idx, v in enumerate(p.composition().voices):
+    cursor.execute('INSERT INTO voice (score, number, range, name) VALUES (?, ?, ?, ?)', (score_id, idx + 1, v.range, v.name))
+    voice_ids.append(cursor.lastrowid)
+  cursor.executemany('INSERT INTO import_voice (voice, print) VALUES (?, ?)',
+                     ((voice_id, p.print_id) for voice_id in voice_ids))
+
+
+def streamEdition(cursor, p, score_key, edition_key):
+  # Stores everything the print refers to and returns the edition id.
+  c = p.composition()
+  editor_ids = [streamPerson(cursor, person) for person in p.edition.authors]
+  composer_ids = [streamPerson(cursor, person) for person in c.authors]
+
+  score_id = lookupId(cursor, 'S', score_key)
+  if score_id is None:
+    cursor.execute('INSERT INTO score (name, genre, key, incipit, year) VALUES (?, ?, ?, ?, ?)', (c.name, c.genre, c.key, c.incipit, c.year))
+    score_id = cursor.lastrowid
+    rememberId(cursor, 'S', score_key, score_id)
+    # The composers are part of the score key, so their links are only
+    # stored once, together with the score.
+    cursor.executemany('INSERT INTO score_author (score, composer) VALUES (?, ?)',
+                       ((score_id, composer_id) for composer_id in set(composer_ids)))
+  storeVoices(cursor, score_id, p)
+
+  edition_id = lookupId(cursor, 'E', edition_key)
+  if edition_id is None:
+    cursor.execute('INSERT INTO edition (name, score) VALUES (?, ?)', (p.edition.name, score_id))
+    edition_id = cursor.lastrowid
+    rememberId(cursor, 'E', edition_key, edition_id)
+    cursor.executemany('INSERT INTO edition_author (edition, editor) VALUES (?, ?)',
+                       ((edition_id, editor_id) for editor_id in set(editor_ids)))
+  return edition_id
+
+
+def streamPrint(cursor, p):
+  score_key, edition_key, digest = printDigests(p)
+  stored = cursor.execute('SELECT digest FROM import_print WHERE id = ?', (p.print_id,)).fetchone()
+  if stored is not None:
+    # A repeated print is fine as long as it is the same print.
+    if stored[0] != digest:
+      raise sqlite3.IntegrityError('UNIQUE constraint failed: print.id')
+    storeVoices(cursor, lookupId(cursor, 'S', score_key), p)
+    cursor.execute('UPDATE import_print SET copies = copies + 1 WHERE id = ?', (p.print_id,))
+    return
+  edition_id = streamEdition(cursor, p, score_key, edition_key)
+  cursor.execute('INSERT INTO print (id, partiture, edition) VALUES (?, ?, ?)', (p.print_id, 'Y' if p.partiture else 'N', edition_id))
+  cursor.execute('INSERT INTO import_print (id, digest) VALUES (?, ?)', (p.print_id, digest))
+
+
+def importStreaming(connection, prints, stats=None):
+  connection.isolation_level = None
+  for pragma in BULK_PRAGMAS:
+    if 'temp_store' not in pragma:
+      connection.execute(pragma)
+  cursor = connection.cursor()
+  cursor.executescript(KEY_TABLES)
+  mentions = 0
+  cursor.execute('BEGIN')
+  try:
+    for p in prints:
+      mentions += len(p.edition.authors) + len(p.composition().authors)
+      streamPrint(cursor, p)
+  except BaseException:
+    cursor.execute('ROLLBACK')
+    raise
+  cursor.execute('COMMIT')
+  if stats is not None:
+    stats['mentions'] += mentions
+    stats['people'] += cursor.execute("SELECT count(*) FROM import_key WHERE kind = 'P'").fetchone()[0]
+  connection.execute('PRAGMA journal_mode = DELETE')
+
+
+def rebuildKeys(cursor):
+  # Computes the digests of a database that was not imported in the
+  # streaming mode, from the stored rows.
+  cursor.execute('DELETE FROM import_key')
+  cursor.execute('DELETE FROM import_print')
+  cursor.execute('DELETE FROM import_voice')
+  names = dict(cursor.execute('SELECT id, name FROM person'))
+  executeBatches(cursor, 'INSERT OR IGNORE INTO import_key (kind, digest, id) VALUES (?, ?, ?)',
+                 (('P', keyDigest(name), id) for id, name in names.items()))
+
+  # The voice rows of a score split into runs, one per print occurrence
+  # that stored them, each numbered from 1.
+  voices = defaultdict(lambda : [])
+  runs = defaultdict(lambda : [])
+  for id, score, number, name, range in cursor.execute('SELECT id, score, number, name, range FROM voice ORDER BY id'):
+    voices[score].append((name, range))
+    if number == 1 or not runs[score]:
+      runs[score].append(([], []))
+    runs[score][-1][0].append(id)
+    runs[score][-1][1].append((number, name, range))
+  composers = defaultdict(lambda : [])
+  for score, composer in cursor.execute('SELECT score, composer FROM score_author'):
+    composers[score].append(names[composer])
+  scores = {}
+  for id, name, incipit, key, genre, year in cursor.execute('SELECT id, name, incipit, key, genre, year FROM score').fetchall():
+    scores[id] = keyDigest(compositionKey(name, incipit, key, genre, year, voices[id], composers[id]))
+  executeBatches(cursor, 'INSERT OR IGNORE INTO import_key (kind, digest, id) VALUES (?, ?, ?)',
+                 (('S', digest, id) for id, digest in scores.items()))
+
+  editors = defaultdict(lambda : [])
+  for edition, editor in cursor.execute('SELECT edition, editor FROM edition_author'):
+    editors[edition].append(names[editor])
+  editions = {}
+  for id, name, score in cursor.execute('SELECT id, name, score FROM edition').fetchall():
+    editions[id] = keyDigest((scores[score], sorted(set(editors[id])), name))
+  executeBatches(cursor, 'INSERT OR IGNORE INTO import_key (kind, digest, id) VALUES (?, ?, ?)',
+                 (('E', digest, id) for id, digest in editions.items()))
+
+  # The row imports store the voices of every print occurrence in the order
+  # of the print ids, repeated prints next to each other, so the runs of a
+  # score are handed to its prints in that order. A print also takes the
+  # runs that follow as long as they repeat its own and more runs than
+  # prints are left; the last print takes whatever remains.
+  prints = defaultdict(lambda : [])
+  for id, score in cursor.execute('SELECT print.id, edition.score FROM print JOIN edition ON edition.id = print.edition ORDER BY print.id').fetchall():
+    prints[score].append(id)
+  copies = {}
+  links = []
+  for score, print_ids in prints.items():
+    score_runs = runs.get(score, [])
+    pos = 0
+    for idx, print_id in enumerate(print_ids):
+      taken = 0
+      while pos < len(score_runs):
+        voice_ids, content = score_runs[pos]
+        if taken and idx < len(print_ids) - 1 and (content != score_runs[pos - taken][1]
+                                                   or len(score_runs) - pos < len(print_ids) - idx):
+          break
+        links.extend((voice_id, print_id) for voice_id in voice_ids)
+        pos += 1
+        taken += 1
+      copies[print_id] = max(taken, 1)
+  executeBatches(cursor, 'INSERT INTO import_voice (voice, print) VALUES (?, ?)', links)
+  executeBatches(cursor, 'INSERT INTO import_print (id, digest, copies) VALUES (?, ?, ?)',
+                 ((id, keyDigest((partiture, editions[edition])), copies[id])
+                  for id, partiture, edition in cursor.execute('SELECT id, partiture, edition FROM print').fetchall()))
+
+
+def releasePrint(cursor, print_id):
+  # Removes the voice rows the print stored and returns its edition; the
+  # print row itself is left to the caller.
+  edition_id = cursor.execute('SELECT edition FROM print WHERE id = ?', (print_id,)).fetchone()[0]
+  cursor.execute('DELETE FROM voice WHERE id IN (SELECT voice FROM import_voice WHERE print = ?)', (print_id,))
+  cursor.execute('DELETE FROM import_voice WHERE print = ?', (print_id,))
+  return edition_id
+
+
+def dropCopies(cursor, print_id, copies, keep):
+  # Removes the voice rows of all but the first keep of the copies the
+  # print stored. The copies of one print all list the same voices.
+  voice_ids = [id for id, in cursor.execute('SELECT voice FROM import_voice WHERE print = ? ORDER BY voice', (print_id,)).fetchall()]
+  extra = [(id,) for id in voice_ids[len(voice_ids) // copies * keep:]]
+  cursor.executemany('DELETE FROM voice WHERE id = ?', extra)
+  cursor.executemany('DELETE FROM import_voice WHERE voice = ?', extra)
+
+
+def deleteOrphans(cursor, edition_ids):
+  # Deletes the editions no print refers to any more, then the scores and
+  # people that are left without an edition or link.
+  people = set()
+  scores = set()
+  removed = defaultdict(int)
+  for edition_id in edition_ids:
+    if cursor.execute('SELECT 1 FROM print WHERE edition = ? LIMIT 1', (edition_id,)).fetchone():
+      continue
+    scores.add(cursor.execute('SELECT score FROM edition WHERE id = ?', (edition_id,)).fetchone()[0])
+    people.update(id for id, in cursor.execute('SELECT editor FROM edition_author WHERE edition = ?', (edition_id,)).fetchall())
+    cursor.execute('DELETE FROM edition_author WHERE edition = ?', (edition_id,))
+    cursor.execute('DELETE FROM edition WHERE id = ?', (edition_id,))
+    cursor.execute("DELETE FROM import_key WHERE kind = 'E' AND id = ?", (edition_id,))
+    removed['orphan editions'] += 1
+  for score_id in scores:
+    if cursor.execute('SELECT 1 FROM edition WHERE score = ? LIMIT 1', (score_id,)).fetchone():
+      continue
+    people.update(id for id, in cursor.execute('SELECT composer FROM score_author WHERE score = ?', (score_id,)).fetchall())
+    cursor.execute('DELETE FROM score_author WHERE score = ?', (score_id,))
+    cursor.execute('DELETE FROM voice WHERE score = ?', (score_id,))
+    cursor.execute('DELETE FROM score WHERE id = ?', (score_id,))
+    cursor.execute("DELETE FROM import_key WHERE kind = 'S' AND id = ?", (score_id,))
+    removed['orphan scores'] += 1
+  for person_id in people:
+    if (cursor.execute('SELECT 1 FROM score_author WHERE composer = ? LIMIT 1', (person_id,)).fetchone()
+        or cursor.execute('SELECT 1 FROM edition_author WHERE editor = ? LIMIT 1', (person_id,)).fetchone()):
+      continue
+    cursor.execute('DELETE FROM person WHERE id = ?', (person_id,))
+    cursor.execute("DELETE FROM import_key WHERE kind = 'P' AND id = ?", (person_id,))
+    removed['orphan people'] += 1
+  return removed
+
+
+def rowCount(cursor, table):
+  return cursor.execute('SELECT count(*) FROM ' + table).fetchone()[0]
+
+
+def importUpdate(connection, prints, stats=None):
+  # Brings an existing database in line with the catalog, touching only the
+  # prints whose digest changed. Returns the counts of what was done.
+  connection.isolation_level = None
+  cursor = connection.cursor()
+  cursor.executescript(KEY_TABLES + REFERENCE_INDEXES)
+  counts = defaultdict(int)
+  cursor.execute('BEGIN')
+  try:
+    # Every print and voice row has to be known to the key tables.
+    if (rowCount(cursor, 'import_print') != rowCount(cursor, 'print')
+        or rowCount(cursor, 'import_voice') != rowCount(cursor, 'voice')):
+      rebuildKeys(cursor)
+    stored = {id: (digest, copies) for id, digest, copies in cursor.execute('SELECT id, digest, copies FROM import_print')}
+    # The digest, occurrences, voice copies and the copies recorded in
+    # import_print of every print id.
+    seen = {}
+    dates = {}
+    mentions = 0
+    released = set()
+    for p in prints:
+      mentions += mergeDates(dates, p)
+      score_key, edition_key, digest = printDigests(p)
+      if p.print_id in seen:
+        # A repeated print is fine as long as it is the same print.
+        entry = seen[p.print_id]
+        if entry[0] != digest:
+          raise sqlite3.IntegrityError('UNIQUE constraint failed: print.id')
+        entry[1] += 1
+        if entry[1] > entry[2]:
+          storeVoices(cursor, lookupId(cursor, 'S', score_key), p)
+          entry[2] += 1
+        continue
+      previous, copies = stored.pop(p.print_id, (None, 0))
+      if previous == digest:
+        seen[p.print_id] = [digest, 1, copies, copies]
+        continue
+      seen[p.print_id] = [digest, 1, 1, 1]
+      partiture = 'Y' if p.partiture else 'N'
+      if previous is None:
+        edition_id = streamEdition(cursor, p, score_key, edition_key)
+        cursor.execute('INSERT INTO print (id, partiture, edition) VALUES (?, ?, ?)', (p.print_id, partiture, edition_id))
+        cursor.execute('INSERT INTO import_print (id, digest) VALUES (?, ?)', (p.print_id, digest))
+        counts['added'] += 1
+      else:
+        released.add(releasePrint(cursor, p.print_id))
+        edition_id = streamEdition(cursor, p, score_key, edition_key)
+        cursor.execute('UPDATE print SET partiture = ?, edition = ? WHERE id = ?', (partiture, edition_id, p.print_id))
+        cursor.execute('UPDATE import_print SET digest = ?, copies = 1 WHERE id = ?', (digest, p.print_id))
+        counts['changed'] += 1
+    # Whatever is left in stored is no longer in the catalog.
+    for print_id in stored:
+      released.add(releasePrint(cursor, print_id))
+      cursor.execute('DELETE FROM print WHERE id = ?', (print_id,))
+      cursor.execute('DELETE FROM import_print WHERE id = ?', (print_id,))
+      counts['removed'] += 1
+    # Prints that now occur fewer times drop their extra voice copies.
+    for print_id, (_, occurrences, copies, recorded) in seen.items():
+      if copies > occurrences:
+        dropCopies(cursor, print_id, copies, occurrences)
+      if recorded != occurrences:
+        cursor.execute('UPDATE import_print SET copies = ? WHERE id = ?', (occurrences, print_id))
+    counts.update(deleteOrphans(cursor, released))
+
+    for id, name, born, died in cursor.execute('SELECT id, name, born, died FROM person').fetchall():
+      if dates.get(name, [born, died]) != [born, died]:
+        cursor.execute('UPDATE person SET born = ?, died = ? WHERE id = ?', dates[name] + [id])
+        counts['people dates'] += 1
+  except BaseException:
+    cursor.execute('ROLLBACK')
+    raise
+  cursor.execute('COMMIT')
+  if stats is not None:
+    stats['mentions'] += mentions
+    stats['people'] += len(dates)
+  return counts
+
+
+# The pipelined import parses record aligned chunks of the file in a
+# process pool while the main thread, the only writer, stores the chunks
+# parsed so far with the streaming import.
+def parseChunk(task):
+  start = time.perf_counter()
+  prints = scorelib.load_chunk(*task)
+  return prints, time.perf_counter() - start
+
+
+class PipelineStats:
+  def __init__(self, workers, queue_size):
+    self.workers = workers
+    self.queue_size = queue_size
+    self.start = time.perf_counter()
+    self.chunks = 0
+    self.records = 0
+    self.parse_time = 0.0
+    self.wait_time = 0.0
+    self.ready = 0
+    self.max_ready = 0
+
+  def report(self, out=None):
+    out = out if out is not None else sys.stderr
+    elapsed = time.perf_counter() - self.start
+    write_time = elapsed - self.wait_time
+    out.write('parse: {} records in {} chunks, {:.2f}s on {} workers ({:.0f} records/s per worker)\n'.format(
+      self.records, self.chunks, self.parse_time, self.workers, self.records / self.parse_time if self.parse_time else 0))
+    out.write('write: {} records in {:.2f}s ({:.0f} records/s), {:.2f}s waiting for the parser\n'.format(
+      self.records, write_time, self.records / write_time if write_time else 0, self.wait_time))
+    out.write('queue: {:.1f} of {} chunks parsed ahead on average, {} at most\n'.format(
+      self.ready / self.chunks if self.chunks else 0, self.queue_size, self.max_ready))
+    out.write('total: {:.2f}s ({:.0f} records/s)\n'.format(elapsed, self.records / elapsed if elapsed else 0))
+
+
+def pipelinePrints(filename, workers, queue_size, stats):
+  # Yields the prints in file order. At most queue_size chunks are handed
+  # to the pool ahead of the writer, which bounds the memory held by parsed
+  # but unwritten prints.
+  queue_size = max(1, queue_size)
+  count = max(workers * 4, os.path.getsize(filename) // PIPELINE_CHUNK)
+  tasks = iter([(filename, start, end) for start, end in scorelib.iter_chunks(filename, count)])
+  with multiprocessing.Pool(workers) as pool:
+    pending = deque(pool.apply_async(parseChunk, (task,)) for task in islice(tasks, queue_size))
+    while pending:
+      ready = sum(1 for result in pending if result.ready())
+      stats.ready += ready
+      stats.max_ready = max(stats.max_ready, ready)
+      start = time.perf_counter()
+      prints, parse_time = pending.popleft().get()
+      stats.wait_time += time.perf_counter() - start
+      for task in islice(tasks, 1):
+        pending.append(pool.apply_async(parseChunk, (task,)))
+      stats.chunks += 1
+      stats.records += len(prints)
+      stats.parse_time += parse_time
+      yield from prints
+
+
+def finishImport(connection, fts=False, analyze=True):
+  connection.executescript(REFERENCE_INDEXES)
+  if fts:
+    connection.executescript(PERSON_FTS)
+  # An incremental import changes little, so the statistics are refreshed
+  # only where SQLite thinks they are out of date.
+  connection.execute('ANALYZE' if analyze else 'PRAGMA optimize')
+  connection.commit()
+
+
+def importRows(connection, prints, stats=None):
   ids = {}
-  connection = sqlite3.connect(args[1])
-  connection.cursor().executescript(open(args[2] if len(args) > 2 else INIT_SCRIPT).read())
-  storePeople(connection, loadPeople(prints), ids)
+  storePeople(connection, loadPeople(prints, stats), ids)
   storeCompositions(connection, loadCompositions(prints), ids)
   storeEditions(connection, loadEditions(prints), ids)
   storePrints(connection, prints, ids)
@@ -121,5 +671,63 @@ def main(args):
   connection.commit()
 
 
+def positiveInt(value):
+  number = int(value)
+  if number < 1:
+    raise argparse.ArgumentTypeError('{} is not a positive number'.format(value))
+  return number
+
+
+def main(args):
+  parser = argparse.ArgumentParser(description='Imports a scorelib text file into an SQLite database.')
+  parser.add_argument('input')
+  parser.add_argument('database')
+  parser.add_argument('init_script', nargs='?', default=INIT_SCRIPT)
+  mode = parser.add_mutually_exclusive_group()
+  mode.add_argument('--bulk', action='store_true',
+                    help='insert with executemany in one explicit transaction, with client side ids and tuned pragmas')
+  mode.add_argument('--stream', action='store_true',
+                    help='import one print at a time, in bounded memory')
+  parser.add_argument('--update', action='store_true',
+                      help='update an existing database to match the input, changing only the prints that differ')
+  parser.add_argument('-j', '--jobs', type=positiveInt, default=1,
+                      help='parse in a pool of JOBS processes while storing what is parsed, as with --stream')
+  parser.add_argument('--queue', type=positiveInt, default=PIPELINE_QUEUE,
+                      help='number of chunks parsed ahead of the writer with --jobs')
+  parser.add_argument('--fts', action='store_true',
+                      help='also build a full text index over the person names')
+  parser.add_argument('--people-stats', action='store_true',
+                      help='report how many person mentions were merged into how many people')
+  args = parser.parse_args(args)
+  if args.bulk and (args.update or args.jobs > 1):
+    parser.error('argument --bulk: not allowed with argument --update or -j/--jobs')
+  people = defaultdict(int) if args.people_stats else None
+  connection = sqlite3.connect(args.database)
+  connection.cursor().executescript(open(args.init_script).read())
+  if args.update or args.stream or args.jobs > 1:
+    stats = None
+    if args.jobs > 1:
+      stats = PipelineStats(args.jobs, args.queue)
+      prints = pipelinePrints(args.input, args.jobs, args.queue, stats)
+    else:
+      prints = scorelib.iter_prints(args.input, share=False)
+    if args.update:
+      counts = importUpdate(connection, prints, people)
+      print(', '.join('{}: {}'.format(name, counts[name]) for name in UPDATE_COUNTS))
+    else:
+      importStreaming(connection, prints, people)
+    if stats is not None:
+      stats.report()
+  else:
+    prints = scorelib.load(args.input)
+    if args.bulk:
+      importBulk(connection, prints, people)
+    else:
+      importRows(connection, prints, people)
+  finishImport(connection, args.fts, not args.update)
+  if people is not None:
+    reportPeople(people)
+
+
 if __name__ == '__main__':
   main(sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,130 @@
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCORELIB = os.path.join(HERE, os.pardir, '01_regex', 'scorelib.txt')
+TABLES = ('person', 'score', 'voice', 'edition', 'print', 'score_author', 'edition_author')
+
+
+def runImport(*args):
+  result = subprocess.run([sys.executable, os.path.join(HERE, 'import.py')] + list(args),
+                          cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+  return result.stdout
+
+
+def canonical(database):
+  # The content of a database independent of the ids it was given: the
+  # size of every table and, for each print, everything it refers to.
+  connection = sqlite3.connect(database)
+  try:
+    counts = [connection.execute('SELECT count(*) FROM ' + t).fetchone()[0] for t in TABLES]
+    people = {id: (name, born, died) for id, name, born, died in
+              connection.execute('SELECT id, name, born, died FROM person')}
+    prints = []
+    for print_id, partiture, edition in connection.execute(
+        'SELECT id, partiture, edition FROM print ORDER BY id').fetchall():
+      name, score = connection.execute('SELECT name, score FROM edition WHERE id = ?', (edition,)).fetchone()
+      editors = sorted([people[e] for (e,) in connection.execute(
+        'SELECT editor FROM edition_author WHERE edition = ?', (edition,))], key=repr)
+      composition = connection.execute(
+        'SELECT name, genre, key, incipit, year FROM score WHERE id = ?', (score,)).fetchone()
+      composers = sorted([people[c] for (c,) in connection.execute(
+        'SELECT composer FROM score_author WHERE score = ?', (score,))], key=repr)
+      voices = sorted(connection.execute(
+        'SELECT number, range, name FROM voice WHERE score = ?', (score,)).fetchall(), key=repr)
+      prints.append((print_id, partiture, name, editors, composition, composers, voices))
+    return counts, prints
+  finally:
+    connection.close()
+
+
+def editCatalog(text):
+  # Removes the second record, renames the first, appends a new print and
+  # repeats the third record verbatim.
+  records = text.strip('\n').split('\n\n')
+  records[0] = re.sub(r'Title: (.*)', r'Title: \1 (revised)', records[0], count=1)
+  added = re.sub(r'Print Number: \d+', 'Print Number: 100000', records[3])
+  added = added.replace('Composer: ', 'Composer: Added ', 1)
+  records = [records[0]] + records[2:] + [added, records[2]]
+  return '\n\n'.join(records) + '\n'
+
+
+def trioRecord(print_id, edition, voices):
+  # A print of one piece; the voice lists of its prints differ but have the
+  # same set of voices, so they all share one score.
+  lines = ['Print Number: {}'.format(print_id), 'Composer: Someone (1700--1750)', 'Title: Trio',
+           'Genre: sonata', 'Key: C', 'Composition Year: 1720', 'Edition: ' + edition,
+           'Editor: Editor ' + edition]
+  lines += ['Voice {}: {}'.format(idx, voice) for idx, voice in enumerate(voices, 1)]
+  lines += ['Partiture: no', 'Incipit: c d e']
+  return '\n'.join(lines)
+
+
+TRIO = {1: trioRecord(1, 'A', ['violin', 'cello']),
+        2: trioRecord(2, 'B', ['violin', 'violin', 'cello']),
+        3: trioRecord(3, 'C', ['violin', 'cello'])}
+
+
+class TestImport(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.addCleanup(self.tmp.cleanup)
+
+  def path(self, name):
+    return os.path.join(self.tmp.name, name)
+
+  def importFresh(self, catalog, name, *options):
+    database = self.path(name)
+    runImport(catalog, database, *options)
+    return canonical(database)
+
+  def test_modes_agree(self):
+    expected = self.importFresh(SCORELIB, 'rows.db')
+    self.assertEqual(expected[0][TABLES.index('print')], 873)
+    for name, options in (('bulk.db', ['--bulk']), ('stream.db', ['--stream']),
+                          ('jobs.db', ['-j', '2']), ('update.db', ['--update'])):
+      with self.subTest(options=options):
+        self.assertEqual(self.importFresh(SCORELIB, name, *options), expected)
+
+  def test_update_matches_fresh_import(self):
+    with open(SCORELIB, encoding='utf-8') as f:
+      text = f.read()
+    edited = self.path('edited.txt')
+    with open(edited, 'w', encoding='utf-8') as f:
+      f.write(editCatalog(text))
+    database = self.path('update.db')
+    runImport(SCORELIB, database)
+    counts = runImport(edited, database, '--update')
+    self.assertIn('added: 1, changed: 1, removed: 1', counts)
+    self.assertEqual(canonical(database), self.importFresh(edited, 'fresh.db'))
+    self.assertEqual(canonical(database), self.importFresh(edited, 'stream.db', '--stream'))
+    runImport(SCORELIB, database, '--update')
+    self.assertEqual(canonical(database), self.importFresh(SCORELIB, 'rows.db'))
+
+  def test_update_prints_of_one_score(self):
+    catalogs = {}
+    for name in ('123', '13', '23', '1123', '1223'):
+      catalogs[name] = self.path(name + '.txt')
+      with open(catalogs[name], 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(TRIO[int(idx)] for idx in name) + '\n')
+    for options in ([], ['--stream'], ['--bulk']):
+      for source, target in (('123', '13'), ('123', '23'), ('1123', '23'), ('1223', '13'), ('123', '1223')):
+        with self.subTest(options=options, source=source, target=target):
+          database = self.path('update.db')
+          if os.path.exists(database):
+            os.remove(database)
+          runImport(catalogs[source], database, *options)
+          runImport(catalogs[target], database, '--update')
+          self.assertEqual(canonical(database), self.importFresh(catalogs[target], 'fresh.db'))
+          os.remove(self.path('fresh.db'))
+
+
+if __name__ == '__main__':
+  unittest.main()
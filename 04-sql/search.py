@@ -15,14 +15,21 @@ def __map2list(mp):
     lst[idx-1] = mp[idx]
   return lst
 
+def __fields(obj):
+  # The scorelib classes use __slots__ and have no __dict__.
+  if hasattr(obj, '__slots__'):
+    return {key: getattr(obj, key) for key in obj.__slots__}
+  return obj.__dict__
+
 def __translate_keys(translation_schema):
   def f(obj):
+    fields = __fields(obj)
     schema = translation_schema.get(type(obj))
     if schema is None:
-      return obj.__dict__
+      return fields
     res = {}
-    for key in obj.__dict__:
-      res[schema.get(key, key)] = obj.__dict__[key]
+    for key in fields:
+      res[schema.get(key, key)] = fields[key]
     return res
   return f
 
@@ -36,10 +43,19 @@ def __to_bool(val):
     return None
 
 
-def search(substr):
-  connection = sqlite3.connect('scorelib.dat')
+def __people_query(connection):
+  # import.py --fts builds a trigram index over the names, which answers
+  # the same substring match without scanning every person.
+  if connection.execute(r"SELECT 1 FROM sqlite_master WHERE name = 'person_fts'").fetchone():
+    return r"SELECT rowid, name FROM person_fts WHERE name LIKE '%' || ? || '%' ORDER BY rowid"
+  return r"SELECT id, name FROM person WHERE name LIKE '%' || ? || '%'"
+
+
+def search(substr, database='scorelib.dat', out=None):
+  out = out if out is not None else sys.stdout
+  connection = sqlite3.connect(database)
   result = defaultdict(lambda: [])
-  for person_id, person_name in connection.execute(r"SELECT id, name FROM person WHERE name LIKE '%' || ? || '%'", (substr, )):
+  for person_id, person_name in connection.execute(__people_query(connection), (substr, )):
     root_composer = person_name
     for (score_id, score_name, score_genre, score_incipit, score_key, score_year) in connection.execute(r"SELECT score.id, score.name, score.genre, score.incipit, score.key, score.year FROM score JOIN score_author a on score.id = a.score WHERE a.composer = ?", (person_id, )):
       voicesMap = {}
@@ -68,7 +84,7 @@ def search(substr):
                                         "Partiture": print.partiture,
                                         "Incipit": composition.incipit})
   json.dump(result,
-            sys.stdout,
+            out,
             default=__translate_keys({Print: {"print_id": "Print Number", "partiture": "Partiture", "edition": "Edition"},
                                       Edition: {"authors": "Editors", "name": "Name", "composition": "Composition"},
                                       Composition: {"name": "Name", "incipit": "Incipit", "key": "Key", "genre": "Genre", "year": "Composition Year", "voices": "Voices", "authors": "Composer"},
@@ -87,4 +103,5 @@ def main(args):
   search(text)
 
 
-main(sys.argv[1:])
\ No newline at end of file
+if __name__ == '__main__':
+  main(sys.argv[1:])
\ No newline at end of file